@@ -1,300 +1,311 @@
-import json
 import os
+import threading
 from collections import defaultdict
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import numpy as np
 import pandas as pd
+from scoring import rating_percent
+from genre_index import SORT_COLUMNS, GenreIndex
+from genre_model import GenreModel
+from instrumentation import timed
+from item_index import ItemIndex
+from search_index import SearchIndex
+from topk import top_k
+from storage import CachedRepository, LogRepository, SqliteRepository
 
 
 
 
-SELECTIONS_JSON = "Website/user_selections.json"
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
-RATINGS_FILE = "Website/user_ratings.json"
+SELECTIONS_JSON = os.path.join(BASE_DIR, "user_selections.json")
 
+RATINGS_FILE = os.path.join(BASE_DIR, "user_ratings.json")
 
-def load_user_ratings_for(username):
-    all_ratings = load_user_ratings()  
-    return [r for r in all_ratings if r['username'] == username]
+USERS_FILE = os.path.join(os.path.dirname(BASE_DIR), "users.json")
 
-def load_user_ratings():
-    if not os.path.exists(RATINGS_FILE):
-        return []
-    with open(RATINGS_FILE, "r") as f:
-        return json.load(f)
-
-def save_user_ratings(ratings):
-    with open(RATINGS_FILE, "w") as f:
-        json.dump(ratings, f, indent=2)
-
-def add_or_update_user_rating(username, appid, rating):
-    ratings = load_user_ratings()
-
-    # Check if user already rated this app
-    for r in ratings:
-        if r['username'] == username and r['appid'] == appid:
-            r['rating'] = rating  # update rating
-            break
-    else:
-        # If not found, append new rating
-        ratings.append({
-            "username": username,
-            "appid": appid,
-            "rating": rating
-        })
+DATABASE = os.path.join(BASE_DIR, "user_data.db")
 
-    save_user_ratings(ratings)
+# Directory of the append-only user data log, used when USER_STORAGE=log
+USER_LOG_DIR = os.path.join(BASE_DIR, "user_data_log")
 
+# 'sqlite' (default) or 'log' (storage.LogRepository)
+USER_STORAGE = os.environ.get('USER_STORAGE', 'sqlite')
 
+ITEMS_CSV = os.path.join(BASE_DIR, "items.csv")
 
-def load_data(csv_path='Website/items.csv'):
-    df = pd.read_csv(csv_path)
-    df['Genres'] = df['Genres'].fillna('NAN')
-    return df
+# Seconds a cached user entry is trusted before it is re-read, so writes made
+# by other worker processes become visible
+CACHE_TTL = 30
 
-def search_items(df, query):
-    query = query.lower()
-    return df[
-        df['Name'].str.lower().str.contains(query) | 
-        df['AppID'].astype(str).str.contains(query)
-    ].to_dict(orient='records')
+_repository = None
+_repository_lock = threading.Lock()
 
 
-def save_user_selection_json(username, appids):
-    if len(appids) != 5:
-        return False
+def get_repository():
+    # Opened lazily; the legacy JSON files are imported on first use
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                if USER_STORAGE == 'log':
+                    # Already in memory and follows other processes' writes, so no cache in front
+                    backend = LogRepository(USER_LOG_DIR)
+                    backend.migrate_from_json(USERS_FILE, SELECTIONS_JSON, RATINGS_FILE)
+                    _repository = backend
+                else:
+                    backend = SqliteRepository(DATABASE)
+                    backend.migrate_from_json(USERS_FILE, SELECTIONS_JSON, RATINGS_FILE)
+                    _repository = CachedRepository(backend, ttl=CACHE_TTL)
+    return _repository
 
-    data = {}
-    if os.path.isfile(SELECTIONS_JSON):
-        with open(SELECTIONS_JSON, "r") as f:
-            data = json.load(f)
 
-    data[username] = appids
+def set_repository(repository):
+    # Swap the storage backend, e.g. storage.MemoryRepository() in tests
+    global _repository
+    _repository = repository
 
-    with open(SELECTIONS_JSON, "w") as f:
-        json.dump(data, f, indent=4)
 
-    return True
+@timed('user_data')
+def load_user_ratings_for(username):
+    return get_repository().ratings_for(username)
 
-def load_user_selection_json(username):
-    if os.path.isfile(SELECTIONS_JSON):
-        with open(SELECTIONS_JSON, "r") as f:
-            data = json.load(f)
-        return data.get(username, [])
-    return []
-
-def calculate_rating_percent(row):
-    try:
-        positive = int(row.get('Positive', 0))
-        negative = int(row.get('Negative', 0))
-        total = positive + negative
-        if total == 0:
-            return 0.0
-        return round((positive / total) * 100, 2)
-    except:
-        return 0.0
-    
-
-def get_top_by_rating(df, n=20):
-    df = df.copy()
-    df['RatingPercent'] = df.apply(lambda row: (
-        round(100 * row['Positive'] / (row['Positive'] + row['Negative']))
-        if row['Positive'] + row['Negative'] > 0 else 0
-    ), axis=1)
-    return df.sort_values(by='RatingPercent', ascending=False).head(n).to_dict(orient='records')
-
-def get_top_overall(df, sort_by='owners', n=20):
-    df = df.copy()
-    if sort_by == 'rating':
-        df['RatingPercent'] = df.apply(calculate_rating_percent, axis=1)
-        return df.sort_values(by='RatingPercent', ascending=False).head(n).to_dict(orient='records')
-    else:
-        return df.sort_values(by='Estimated owners', ascending=False).head(n).to_dict(orient='records')
+@timed('user_data')
+def load_user_ratings():
+    return get_repository().all_ratings()
+
+# Weight of a 1-5 star rating in the user's genre profile; low ratings still count a little
+RATING_WEIGHTS = {1: 0.1, 2: 0.3, 3: 0.5, 4: 0.8, 5: 1.0}
 
+RATINGS_PROFILE = 'ratings'
+SELECTIONS_PROFILE = 'selections'
 
 
+def profile_kind(kind, catalog_fingerprint):
+    # Profiles are stored per catalog file version, since a new items.csv may
+    # change the genres of the games they were built from
+    return '%s@%s' % (kind, catalog_fingerprint)
 
-def get_top_genre_blocks(df, top_n_genres=10, top_n_games=20, sort_by='owners'):
-    genre_df = df.copy()
-    genre_df['Genres'] = genre_df['Genres'].str.split(',')
-    genre_df = genre_df.explode('Genres')
-    genre_df['Genres'] = genre_df['Genres'].str.strip()
 
-    top_genres = (
-        genre_df.groupby('Genres')['Estimated owners']
-        .sum()
-        .sort_values(ascending=False)
-        .head(top_n_genres)
-        .index.tolist()
+def rating_weight(rating):
+    if rating is None:
+        return 0.0
+    return RATING_WEIGHTS.get(int(round(float(rating))), 0.0)
+
+
+def add_or_update_user_rating(username, appid, rating, catalog_fingerprint, genres=None):
+    # genres: the rated game's genres in that catalog version, used to move the
+    # stored rating profile by the change in rating weight in the same write
+    # as the rating; without them the profile is dropped and rebuilt on the
+    # next read
+    repository = get_repository()
+    kind = profile_kind(RATINGS_PROFILE, catalog_fingerprint)
+    if genres is None:
+        repository.upsert_rating(username, appid, rating)
+        repository.delete_genre_profile(username, kind)
+        return
+    previous = next((r['rating'] for r in repository.ratings_for(username) if r['appid'] == appid), None)
+    delta = rating_weight(rating) - rating_weight(previous)
+    deltas = defaultdict(float)
+    if delta:
+        for genre in genres:
+            deltas[genre] += delta
+    repository.upsert_rating_with_profile(username, appid, rating, kind, previous, dict(deltas))
+
+
+@timed('user_data')
+def load_user_genre_weights(username, df, catalog_fingerprint, item_index=None):
+    # (rating profile, selection profile) of a user in the catalog version
+    # `df` comes from; a profile that is not stored yet is built from the
+    # user's ratings or selections and saved
+    repository = get_repository()
+    rating_weights = repository.ensure_genre_profile(
+        username, profile_kind(RATINGS_PROFILE, catalog_fingerprint),
+        lambda selection, ratings: rating_genre_weights(df, ratings, item_index),
     )
+    selection_weights = repository.ensure_genre_profile(
+        username, profile_kind(SELECTIONS_PROFILE, catalog_fingerprint),
+        lambda selection, ratings: selection_genre_weights(df, selection, item_index),
+    )
+    return rating_weights, selection_weights
 
-    genre_blocks = {}
-    for genre in top_genres:
-        filtered = genre_df[genre_df['Genres'] == genre].copy()
 
-        if sort_by == 'rating':
-            filtered['RatingPercent'] = filtered.apply(lambda row: (
-                round(100 * row['Positive'] / (row['Positive'] + row['Negative']))
-                if row['Positive'] + row['Negative'] > 0 else 0
-            ), axis=1)
-            top_games = filtered.sort_values(by='RatingPercent', ascending=False).head(top_n_games)
-        else:
-            top_games = filtered.sort_values(by='Estimated owners', ascending=False).head(top_n_games)
 
-        genre_blocks[genre] = top_games.to_dict(orient='records')
+@timed('load_data')
+def load_data(csv_path=ITEMS_CSV):
+    df = pd.read_csv(csv_path)
+    df['Genres'] = df['Genres'].fillna('NAN')
+    return df
 
-    return genre_blocks
+@timed('search')
+def search_items(df, query, search_index=None, limit=None):
+    # search_index must have been built from this same df (see catalog.Catalog)
+    if search_index is None:
+        search_index = SearchIndex.build(df)
+    return search_index.search(query, limit=limit)
 
-def get_personalized_blocks(df, user_selected_appids, top_n=10, top_n_games=20, sort_by='owners'):
-    # Filter user's selected games from df
-    user_games_df = df[df['AppID'].astype(str).isin(user_selected_appids)]
 
-    if user_games_df.empty:
-        return [], {}
+def save_user_selection_json(username, appids, catalog_fingerprint, genre_weights=None):
+    # genre_weights: selection_genre_weights() of the new picks in the catalog
+    # version with that fingerprint, stored as the user's selection profile;
+    # without them the profile is rebuilt on next read
+    if len(appids) != 5:
+        return False
 
-    # Extract unique genres from user's games
-    user_genres_list = []
-    for genres_str in user_games_df['Genres'].fillna(''):
-        user_genres_list.extend([g.strip() for g in genres_str.split(',') if g.strip()])
-    user_genres_list = list(set(user_genres_list))
+    repository = get_repository()
+    repository.save_selection(username, appids)
+    kind = profile_kind(SELECTIONS_PROFILE, catalog_fingerprint)
+    if genre_weights is None:
+        repository.delete_genre_profile(username, kind)
+    else:
+        repository.save_genre_profile(username, kind, genre_weights)
+    return True
 
-    all_genres = df['Genres'].fillna('').unique()
+def load_user_selection_json(username):
+    return get_repository().selection_for(username)
 
-    vectorizer = TfidfVectorizer()
-    all_genre_vectors = vectorizer.fit_transform(all_genres)
+# The ranking functions below return catalog row positions (best first, ties
+# in catalog order); cards.game_cards turns them into what templates display.
 
-    user_genre_vectors = vectorizer.transform([' '.join(user_genres_list)])
+@timed('top_by_rating')
+def get_top_by_rating(df, n=20, exclude=None):
+    return top_k(rating_percent(df['Positive'], df['Negative']), n, exclude)
 
-    sim_scores = cosine_similarity(user_genre_vectors, all_genre_vectors).flatten()
+@timed('top_overall')
+def get_top_overall(df, sort_by='owners', n=20, exclude=None):
+    if sort_by == 'rating':
+        return top_k(rating_percent(df['Positive'], df['Negative'], decimals=2), n, exclude)
+    return top_k(df[SORT_COLUMNS.get(sort_by, 'Estimated owners')].to_numpy(), n, exclude)
 
-    top_indices = sim_scores.argsort()[::-1][:top_n]
 
-    top_similar_genres = [all_genres[i] for i in top_indices if all_genres[i].strip() != '']
+@timed('genre_blocks')
+def get_top_genre_blocks(df, top_n_genres=10, top_n_games=20, sort_by='owners', genre_index=None):
+    # genre_index must have been built from this same df (see catalog.Catalog)
+    if genre_index is None:
+        genre_index = GenreIndex(df)
 
+    # The posting lists are pre-sorted, so each block is a prefix slice
     genre_blocks = {}
-    for genre_str in top_similar_genres:
-        filtered = df[df['Genres'].str.contains(genre_str, case=False, na=False)].copy()
-
-        if sort_by == 'rating':
-            filtered['RatingPercent'] = filtered.apply(lambda row: (
-                round(100 * row['Positive'] / (row['Positive'] + row['Negative']))
-                if row['Positive'] + row['Negative'] > 0 else 0), axis=1)
-            top_games = filtered.sort_values(by='RatingPercent', ascending=False).head(top_n_games)
-        else:
-            top_games = filtered.sort_values(by='Estimated owners', ascending=False).head(top_n_games)
-
-        genre_blocks[genre_str] = top_games.to_dict(orient='records')
+    for genre in genre_index.top_genres(top_n_genres):
+        genre_blocks[genre] = genre_index.top_rows(genre, sort_by, top_n_games)
 
-    return [], genre_blocks
-
-
-
-def get_personalized_blocks_with_ratings(df, user_ratings, top_n=10, top_n_games=20, sort_by='owners'):
-    # user_ratings: list of dicts, e.g. [{'username': 'bob', 'appid': '123', 'rating': 5}, ...]
+    return genre_blocks
 
-    rating_map = {str(r['appid']): r['rating'] for r in user_ratings}
+def split_genres(text):
+    return [g.strip() for g in text.split(',') if g.strip()] if isinstance(text, str) else []
 
-    # Filter games that user rated
-    rated_games_df = df[df['AppID'].astype(str).isin(rating_map.keys())]
 
-    if rated_games_df.empty:
-        return [], {}
+def _genre_rows(df, rows):
+    # Genre lists of the given catalog rows
+    return [split_genres(text) for text in df['Genres'].iloc[rows].tolist()]
 
-    # Weighted genre scores accumulator
-    genre_scores = defaultdict(float)
 
-    # For each rated game, parse genres and add weighted score by rating
-    for _, row in rated_games_df.iterrows():
-        appid = str(row['AppID'])
-        rating = rating_map.get(appid, 0)
+def selection_genre_weights(df, user_selected_appids, item_index=None):
+    # {genre: 1.0} for every genre of the user's selected games
+    if item_index is None:
+        item_index = ItemIndex(df)
+    rows = np.sort(item_index.rows(user_selected_appids))
+    return {genre: 1.0 for genres in _genre_rows(df, rows) for genre in genres}
 
-        # Include all ratings, assign small weights to low ratings
-        rating_weight_map = {1: 0.1, 2: 0.3, 3: 0.5, 4: 0.8, 5: 1.0}
-        weight = rating_weight_map.get(int(round(rating)), 0.0)
-
-        genres_str = row['Genres'] if pd.notnull(row['Genres']) else ''
-        genres = [g.strip() for g in genres_str.split(',') if g.strip()]
 
+def rating_genre_weights(df, user_ratings, item_index=None):
+    # {genre: summed rating weight} over the user's rated games
+    if item_index is None:
+        item_index = ItemIndex(df)
+    rating_map = {str(r['appid']): r['rating'] for r in user_ratings}
+    rated = sorted((row, rating_map[appid]) for appid, row in
+                   ((appid, item_index.position(appid)) for appid in rating_map) if row is not None)
+    weights = defaultdict(float)
+    for (row, rating), genres in zip(rated, _genre_rows(df, [row for row, _ in rated])):
         for genre in genres:
-            genre_scores[genre] += weight
-
-    if not genre_scores:
-        return [], {}
+            weights[genre] += rating_weight(rating)
+    return dict(weights)
 
-    # Create weighted genre list (repeat genres by weighted score)
-    weighted_genres = []
-    for genre, score in genre_scores.items():
-        repeat_count = max(1, int(score * 15))  # Adjust scale factor as needed
-        weighted_genres.extend([genre] * repeat_count)
 
-    all_genres = df['Genres'].fillna('').unique()
-    vectorizer = TfidfVectorizer()
-    all_genre_vectors = vectorizer.fit_transform(all_genres)
+def _blocks_for_weights(df, genre_weights, top_n, top_n_games, sort_by, genre_index, genre_model, exclude):
+    if genre_model is None:
+        genre_model = GenreModel.fit(df)
 
-    user_genre_vector = vectorizer.transform([' '.join(weighted_genres)])
-    sim_scores = cosine_similarity(user_genre_vector, all_genre_vectors).flatten()
+    top_similar_genres = genre_model.similar_genres_for_weights(genre_weights, top_n)
 
-    top_indices = sim_scores.argsort()[::-1][:top_n]
-    top_similar_genres = [all_genres[i] for i in top_indices if all_genres[i].strip() != '']
+    if genre_index is None:
+        genre_index = GenreIndex(df)
 
     genre_blocks = {}
     for genre_str in top_similar_genres:
-        filtered = df[df['Genres'].str.contains(genre_str, case=False, na=False)].copy()
+        # Games carrying every genre of the combination, not a substring match
+        genres = [g.strip() for g in genre_str.split(',') if g.strip()]
+        genre_blocks[genre_str] = genre_index.rows_with_all(genres, sort_by, top_n_games, exclude)
 
-        if sort_by == 'rating':
-            filtered['RatingPercent'] = filtered.apply(
-                lambda row: (
-                    round(100 * row['Positive'] / (row['Positive'] + row['Negative']))
-                    if row['Positive'] + row['Negative'] > 0 else 0
-                ),
-                axis=1
-            )
-            top_games = filtered.sort_values(by='RatingPercent', ascending=False).head(top_n_games)
-        else:
-            top_games = filtered.sort_values(by='Estimated owners', ascending=False).head(top_n_games)
-
-        genre_blocks[genre_str] = top_games.to_dict(orient='records')
-
-    return [], genre_blocks
+    return genre_blocks
 
 
-def load_user_selections(username, path=SELECTIONS_JSON):
-    if not os.path.isfile(path):
-        return []
-    with open(path, "r") as f:
-        data = json.load(f)
-    return data.get(username, [])
+@timed('personalized')
+def get_personalized_blocks(df, user_selected_appids, top_n=10, top_n_games=20, sort_by='owners', genre_index=None, genre_model=None, item_index=None, exclude=None, genre_weights=None):
+    # genre_weights: the user's stored selection profile; rebuilt from the
+    # selected games when not given
+    if genre_weights is None:
+        genre_weights = selection_genre_weights(df, user_selected_appids, item_index)
 
+    if not genre_weights:
+        return [], {}
 
+    return [], _blocks_for_weights(df, genre_weights, top_n, top_n_games, sort_by, genre_index, genre_model, exclude)
 
-def get_items(path="Website/items.csv"):
-    df = pd.read_csv(path)
-    return df.to_dict(orient='records')  # returns list of dicts
 
 
-# Function to load users from a file
-def load_users(filename='users.json'):
-    try:
-        with open(filename, 'r') as file:
-            users = json.load(file)
-    except FileNotFoundError:
-        users = {}
-    return users
+@timed('personalized_ratings')
+def get_personalized_blocks_with_ratings(df, user_ratings, top_n=10, top_n_games=20, sort_by='owners', genre_index=None, genre_model=None, item_index=None, exclude=None, genre_weights=None):
+    # user_ratings: list of dicts, e.g. [{'username': 'bob', 'appid': '123', 'rating': 5}, ...]
+    # genre_weights: the user's stored rating profile; rebuilt from
+    # user_ratings when not given. The weights are the TF-IDF query directly.
+    if genre_weights is None:
+        genre_weights = rating_genre_weights(df, user_ratings, item_index)
 
-# Function to save users to a file
-def save_users(users, filename='users.json'):
-    with open(filename, 'w') as file:
-        json.dump(users, file)
+    if not genre_weights:
+        return [], {}
 
+    return [], _blocks_for_weights(df, genre_weights, top_n, top_n_games, sort_by, genre_index, genre_model, exclude)
 
 
+@timed('collaborative')
+def get_collaborative_blocks(df, user_ratings, recommender, top_n_games=20, sort_by='owners', exclude=None):
+    # recommender: collaborative.ItemItemRecommender fitted on this same df
+    rows = recommender.recommend(user_ratings, n=top_n_games, exclude=exclude)
+    if len(rows) == 0:
+        return [], {}
+    return [], {'Recommended': rows}
 
 
+@timed('user_blocks')
+def get_personalized_user_blocks(df, user_selected_appids, user_ratings, sort_by='owners', genre_index=None, genre_model=None, recommender=None, item_index=None, rating_weights=None, selection_weights=None):
+    # Personalized genre blocks for one user, without the games they already
+    # picked or rated; {} when the user has neither ratings nor selections
+    if item_index is None:
+        item_index = ItemIndex(df)
+    # Seen games are masked out before each block's top-K cut
+    exclude = item_index.mask(list(user_selected_appids) + [r['appid'] for r in user_ratings])
 
+    genre_blocks = {}
+    if user_ratings and recommender is not None:
+        _, genre_blocks = get_collaborative_blocks(df, user_ratings, recommender, sort_by=sort_by, exclude=exclude)
 
+    if not genre_blocks and user_ratings:
+        _, genre_blocks = get_personalized_blocks_with_ratings(df, user_ratings, sort_by=sort_by, genre_index=genre_index, genre_model=genre_model, item_index=item_index, exclude=exclude, genre_weights=rating_weights)
+    elif not genre_blocks and user_selected_appids:
+        _, genre_blocks = get_personalized_blocks(df, user_selected_appids, sort_by=sort_by, genre_index=genre_index, genre_model=genre_model, item_index=item_index, exclude=exclude, genre_weights=selection_weights)
 
+    return genre_blocks
 
 
+@timed('user_data')
+def load_user_selections(username):
+    return get_repository().selection_for(username)
 
 
+# Function to load users from storage
+def load_users():
+    return get_repository().load_users()
 
+# Function to add a new user; False when the username is already taken
+def register_user(username, password):
+    return get_repository().create_user(username, password)
@@ -1,62 +1,287 @@
-from flask import Flask, render_template, request, abort
-import pandas as pd
+import cProfile
+import hashlib
+import io
+import json
 import os
+import pstats
+import time
+
+from flask import Flask, render_template, request, abort, jsonify, g
+from flask import before_render_template, template_rendered
 from flask import session, flash
 from flask import redirect, url_for
-from Backend import load_users, save_users, load_data, get_top_by_rating,  get_personalized_blocks_with_ratings, load_user_ratings_for, get_top_overall, add_or_update_user_rating, get_top_genre_blocks,  get_items, save_user_selection_json, load_user_selection_json, get_personalized_blocks, load_user_selections
+from cache import LRUCache, TTLCache, cache_stats
+from cards import block_cards, game_cards
+from catalog import get_catalog
+from collaborative import ItemItemRecommender
+from genre_index import SORT_COLUMNS
+from http_cache import compress_response, conditional_page
+from instrumentation import (REQUEST_LATENCY, REQUESTS, record, render_metrics, server_timing_header, stage,
+                             start_timings, stop_timings, timing_active)
+from precompute import RECOMMENDATIONS_DB, RecommendationStore, decode_blocks, user_fingerprint
+from Backend import CACHE_TTL, load_user_ratings, load_users, register_user, get_top_by_rating, load_user_ratings_for, get_top_overall, add_or_update_user_rating, get_top_genre_blocks, save_user_selection_json, load_user_selection_json, load_user_selections, get_personalized_user_blocks, load_user_genre_weights, selection_genre_weights, split_genres
 
-app = Flask(__name__)
+# The folders are capitalised, which matters on case-sensitive filesystems
+app = Flask(__name__, template_folder="Templates", static_folder="Static", static_url_path="/static")
 
 
 app.secret_key = 'your-secret-key'  # Set a secure secret key for session encryption
 
-basedir = os.path.abspath(os.path.dirname(__file__))
-csv_path = os.path.join(basedir, "items.csv")
-items_df = pd.read_csv(csv_path)
+# Personalization engine for logged-in users: 'genre' (TF-IDF genre similarity)
+# or 'cf' (item-item collaborative filtering). ?engine= overrides it per request.
+app.config['RECOMMENDER'] = 'genre'
+RECOMMENDERS = ('genre', 'cf')
+
+# Most search results shown on the home page / suggestions from /api/autocomplete
+SEARCH_LIMIT = 100
+AUTOCOMPLETE_LIMIT = 10
+# Page size of /api/items, which the setup page loads incrementally
+ITEMS_PAGE_SIZE = 50
+ITEMS_MAX_PAGE_SIZE = 200
+# Similar games listed on an item page
+SIMILAR_LIMIT = 10
+
+# Non-personalized home page rankings, per filter value. Entries are dropped
+# on catalog reload. Rendered pages are cached by http_cache, per ETag.
+anonymous_blocks_cache = TTLCache('anonymous_blocks', ttl=300)
+
+# Seconds browsers may reuse static files without asking again
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 24 * 3600
+
+# Instrumentation, all off by default apart from the /metrics counters:
+# SERVER_TIMING=1 adds a Server-Timing header with per-stage times to every
+# response; PROFILING=1 (or debug mode) lets ?profile=1 return a cProfile
+# report instead of the page; PROFILE_DIR=<dir> writes a .prof file for
+# every request.
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING') == '1'
+app.config['PROFILING'] = os.environ.get('PROFILING') == '1'
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR')
+PROFILE_REPORT_LINES = 60
+
+
+def get_anonymous_blocks(catalog, filter_option):
+    def compute():
+        df = catalog.df
+        top_overall = get_top_by_rating(df) if filter_option == 'rating' else get_top_overall(df, filter_option)
+        genre_blocks = get_top_genre_blocks(df, sort_by=filter_option, genre_index=catalog.genre_index)
+        return game_cards(df, top_overall), block_cards(df, genre_blocks, label_with_genre=True)
+    return anonymous_blocks_cache.get_or_compute(filter_option, compute, catalog.version)
+
+
+# Item-item model over everyone's ratings, refitted every few minutes
+collaborative_model_cache = TTLCache('collaborative_model', ttl=300, max_entries=1)
+
+
+def _collaborative_entry(catalog):
+    # (digest of the ratings the model was fitted on, model); the digest is
+    # the model's version in ETags, and the same in every worker that fitted
+    # it on the same ratings
+    def fit():
+        ratings = load_user_ratings()
+        payload = json.dumps(sorted([r['username'], str(r['appid']), r['rating']] for r in ratings))
+        model = ItemItemRecommender.fit(catalog.df, ratings, item_positions=catalog.item_index.positions)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest(), model
+    return collaborative_model_cache.get_or_compute('model', fit, catalog.version)
+
+
+# Personalized blocks per (username, filter, engine) and the version parts of
+# the page's ETag (see UserInputs), so a cached body always matches its ETag
+user_blocks_cache = LRUCache('user_blocks', max_entries=1024, ttl=CACHE_TTL)
+
+
+class UserInputs:
+    """What a user's home page is computed from, read once per request.
+
+    The selections, ratings and genre profiles, and with the 'cf' engine the
+    collaborative model with the digest of the ratings it was fitted on.
+    etag_parts() are derived from exactly these values and get_user_blocks()
+    computes from them, so a page is never cached under an ETag it was not
+    built for, even while another worker is writing the user's data.
+    """
+
+    def __init__(self, catalog, username, engine):
+        self.username = username
+        self.selected_appids = load_user_selections(username)
+        self.ratings = load_user_ratings_for(username)
+        self.fingerprint = user_fingerprint(self.selected_appids, self.ratings)
+        self.rating_weights, self.selection_weights = load_user_genre_weights(
+            username, catalog.df, catalog.fingerprint, catalog.item_index
+        )
+        profiles = json.dumps([sorted((self.rating_weights or {}).items()),
+                               sorted((self.selection_weights or {}).items())])
+        self.profiles_digest = hashlib.sha1(profiles.encode('utf-8')).hexdigest()
+        self.model_digest = None
+        self.recommender = None
+        if engine == 'cf' and self.ratings:
+            self.model_digest, self.recommender = _collaborative_entry(catalog)
+
+    def etag_parts(self):
+        parts = (self.username, self.fingerprint, self.profiles_digest)
+        if self.model_digest is not None:
+            parts += (self.model_digest,)
+        return parts
+
+
+def get_user_blocks(catalog, inputs, filter_option, engine='genre'):
+    def compute():
+        df = catalog.df
+        genre_blocks = None
+        store = get_recommendation_store()
+        if store is not None:
+            payload = store.get(inputs.username, filter_option, engine, catalog.fingerprint, inputs.fingerprint)
+            if payload is not None:
+                genre_blocks = decode_blocks(payload)
+
+        if genre_blocks is None:
+            genre_blocks = get_personalized_user_blocks(
+                df, inputs.selected_appids, inputs.ratings, sort_by=filter_option,
+                genre_index=catalog.genre_index, genre_model=catalog.genre_model, recommender=inputs.recommender,
+                item_index=catalog.item_index, rating_weights=inputs.rating_weights,
+                selection_weights=inputs.selection_weights,
+            )
+
+        if genre_blocks:
+            return [], block_cards(df, genre_blocks)
+        return get_anonymous_blocks(catalog, filter_option)
+
+    key = (filter_option, engine) + inputs.etag_parts()
+    return user_blocks_cache.get_or_compute(key, compute, catalog.version)
+
+
+_recommendation_store = None
+
+
+def get_recommendation_store():
+    # Only present once the offline precompute job (precompute.py) has run
+    global _recommendation_store
+    if _recommendation_store is None and os.path.isfile(RECOMMENDATIONS_DB):
+        _recommendation_store = RecommendationStore(RECOMMENDATIONS_DB)
+    return _recommendation_store
+
+
+def _profile_requested():
+    return bool(request.args.get('profile')) and (app.config['PROFILING'] or app.debug)
+
+
+@app.before_request
+def start_instrumentation():
+    g.request_start = time.perf_counter()
+    profile_report = _profile_requested()
+    if app.config['SERVER_TIMING'] or profile_report:
+        g.timings_token = start_timings()
+    if profile_report or app.config['PROFILE_DIR']:
+        g.profile_report = profile_report
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@app.after_request
+def finish_instrumentation(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+    elapsed = time.perf_counter() - g.pop('request_start', time.perf_counter())
+
+    token = g.pop('timings_token', None)
+    if token is not None:
+        response.headers['Server-Timing'] = server_timing_header(stop_timings(token), elapsed)
+
+    # Routes are labelled by their rule, e.g. /item/<appid>, to keep label sets small
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_LATENCY.observe(elapsed, (route, request.method))
+    REQUESTS.inc(1, (route, request.method, str(response.status_code)))
+
+    if profiler is not None:
+        if app.config['PROFILE_DIR']:
+            name = '%d-%s.prof' % (time.time() * 1000, request.endpoint or 'unmatched')
+            profiler.dump_stats(os.path.join(app.config['PROFILE_DIR'], name))
+        if g.pop('profile_report', False):
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_REPORT_LINES)
+            response = app.response_class(report.getvalue(), mimetype='text/plain')
+    return response
+
+
+@app.after_request
+def compress(response):
+    # Registered after the instrumentation hook so that it runs first and is timed
+    return compress_response(response)
+
+
+@app.teardown_request
+def reset_instrumentation(exc):
+    # after_request is skipped when a response could not be built at all
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+    token = g.pop('timings_token', None)
+    if token is not None:
+        stop_timings(token)
+
+
+def _render_started(sender, template, context, **extra):
+    if timing_active():
+        g.render_start = time.perf_counter()
+
+
+def _render_finished(sender, template, context, **extra):
+    start = g.pop('render_start', None)
+    if start is not None:
+        record('render', time.perf_counter() - start)
+
+
+before_render_template.connect(_render_started, app)
+template_rendered.connect(_render_finished, app)
+
 
 @app.route('/')
 def home():
     username = session.get('username')
     query = request.args.get('q', '').strip()
     filter_option = request.args.get('filter', 'owners')
-    df = load_data()
-
-    df['RatingPercent'] = df.apply(lambda row: (
-        round(100 * row['Positive'] / (row['Positive'] + row['Negative']))
-        if row['Positive'] + row['Negative'] > 0 else 0
-    ), axis=1)
-
-    user_selected_appids = []
-    user_ratings = []
+    if filter_option not in SORT_COLUMNS:
+        filter_option = 'owners'
+    engine = request.args.get('engine', app.config['RECOMMENDER'])
+    if engine not in RECOMMENDERS:
+        engine = app.config['RECOMMENDER']
+    catalog = get_catalog()
+
+    inputs = None
+    if query:
+        etag_parts = (catalog.fingerprint, username, filter_option, query)
+    elif username:
+        inputs = UserInputs(catalog, username, engine)
+        etag_parts = (catalog.fingerprint, filter_option, engine) + inputs.etag_parts()
+    else:
+        etag_parts = (catalog.fingerprint, filter_option)
+    return conditional_page(etag_parts, lambda: render_home(catalog, username, query, filter_option, engine, inputs))
+
+
+def render_home(catalog, username, query, filter_option, engine, inputs=None):
+    df = catalog.df
+    if not username and not query:
+        top_overall, genre_blocks = get_anonymous_blocks(catalog, filter_option)
+        return render_template(
+            'home.html',
+            query=query,
+            filter=filter_option,
+            search_results=[],
+            top_overall=top_overall,
+            genre_blocks=genre_blocks
+        )
 
     search_results = []
     if query:
-        search_results = df[df['AppID'].str.contains(query, case=False, na=False)].to_dict(orient='records')
-        sort_key = 'RatingPercent' if filter_option == 'rating' else 'Estimated owners'
-        search_results.sort(key=lambda x: x.get(sort_key, 0), reverse=True)
+        # Ranked by relevance first, then by the selected filter
+        with stage('search'):
+            popularity = df[SORT_COLUMNS[filter_option]].to_numpy()
+            rows = catalog.search_index().search(query, limit=SEARCH_LIMIT, popularity=popularity)
+        search_results = game_cards(df, rows)
 
         top_overall = []
         genre_blocks = {}
     else:
-        if username:
-            user_selected_appids = load_user_selections(username)
-            user_ratings = load_user_ratings_for(username)
-
-        if username and user_ratings:
-            _, genre_blocks = get_personalized_blocks_with_ratings(df, user_ratings, sort_by=filter_option)
-            top_overall = []
-        elif user_selected_appids:
-            _, genre_blocks = get_personalized_blocks(df, user_selected_appids, sort_by=filter_option)
-            top_overall = []
-        else:
-            top_overall = get_top_overall(df) if filter_option == 'owners' else get_top_by_rating(df)
-            genre_blocks = get_top_genre_blocks(df, sort_by=filter_option)
-
-    user_appids_to_exclude = set(user_selected_appids) | set(str(r['appid']) for r in user_ratings)
-
-    top_overall = [item for item in top_overall if str(item['AppID']) not in user_appids_to_exclude]
-    for genre, games in genre_blocks.items():
-        genre_blocks[genre] = [game for game in games if str(game['AppID']) not in user_appids_to_exclude]
+        top_overall, genre_blocks = get_user_blocks(catalog, inputs, filter_option, engine)
 
     return render_template(
         'home.html',
@@ -68,14 +293,83 @@ def home():
     )
 
 
+@app.route("/api/autocomplete")
+def autocomplete():
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', AUTOCOMPLETE_LIMIT, type=int), 1), SEARCH_LIMIT)
+    return jsonify(get_catalog().search_index().complete(query, limit=limit))
+
+
+def item_summaries(df, rows):
+    # Slim projection for list views: no tags, descriptions or other long columns
+    page = df.iloc[rows]
+    return [
+        {
+            'id': str(appid),
+            'name': str(appid),
+            'genres': [genre.strip() for genre in genres.split(',') if genre.strip()] if genres != 'NAN' else [],
+            'owners': int(owners),
+        }
+        for appid, genres, owners in zip(page['AppID'], page['Genres'].astype(str), page['Estimated owners'])
+    ]
+
+
+@app.route("/api/items")
+def api_items():
+    # ?q= searches server-side; ?offset= and ?limit= page through the results
+    query = request.args.get('q', '').strip()
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', ITEMS_PAGE_SIZE, type=int), 1), ITEMS_MAX_PAGE_SIZE)
+    catalog = get_catalog()
+
+    def render():
+        if query:
+            rows = catalog.search_index().search(query)
+            total = len(rows)
+            rows = rows[offset:offset + limit]
+        else:
+            total = len(catalog.df)
+            rows = range(offset, min(offset + limit, total))
+        return app.json.dumps({
+            'items': item_summaries(catalog.df, rows),
+            'offset': offset,
+            'limit': limit,
+            'total': total,
+        })
+
+    return conditional_page((catalog.fingerprint, query, offset, limit), render, mimetype='application/json')
+
+
+@app.route("/cache/stats")
+def cache_stats_page():
+    return jsonify(cache_stats())
+
+
+@app.route("/metrics")
+def metrics():
+    # Prometheus text format; counts cover this worker process only
+    return app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route("/item/<appid>")
 def item_page(appid):
-    # appid is now a string
-    match = items_df[items_df["AppID"].astype(str) == appid]
-    if match.empty:
+    # appid is the string key of catalog.item_index
+    catalog = get_catalog()
+    row = catalog.item_index.position(appid)
+    if row is None:
         abort(404)
-    item = match.iloc[0].to_dict()
-    return render_template("item.html", item=item)
+
+    # Not built until the offline jobs have run for this catalog version
+    similar_items = catalog.similar_items()
+
+    def render():
+        item = catalog.df.iloc[row].to_dict()
+        similar = []
+        if similar_items is not None:
+            similar = game_cards(catalog.df, similar_items.similar(row, SIMILAR_LIMIT))
+        return render_template("Item.html", item=item, similar=similar)
+
+    return conditional_page((catalog.fingerprint, session.get('username'), similar_items is not None), render)
 
 
 
@@ -83,13 +377,18 @@ def item_page(appid):
 def submit_review(appid):
     if 'username' not in session:
         return redirect(url_for('login'))
-    
+    catalog = get_catalog()
+    position = catalog.item_index.position(appid)
+    if position is None:
+        abort(404)
+
     rating = request.form.get('rating')
     if not rating or not rating.isdigit() or int(rating) not in range(1, 6):
         flash("Please provide a valid rating between 1 and 5.")
         return redirect(url_for('item_page', appid=appid))
 
-    add_or_update_user_rating(session['username'], appid, int(rating))
+    genres = split_genres(catalog.df['Genres'].iloc[position])
+    add_or_update_user_rating(session['username'], appid, int(rating), catalog.fingerprint, genres)
     flash("Your rating has been saved!")
     return redirect(url_for('item_page', appid=appid))
 
@@ -131,9 +430,11 @@ def register():
         elif password != confirm:
             message = "Passwords do not match."
             return render_template("register.html", message=message)
+        elif not register_user(username, password):
+            # Registered on another worker since the check above
+            message = "Username already exists. Please choose a different username."
+            return render_template("register.html", message=message)
         else:
-            users[username] = password
-            save_users(users)
             session['username'] = username  # log them in or store for setup
             return redirect(url_for('setup'))
 
@@ -147,20 +448,23 @@ def setup():
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    items = get_items()
-
     if request.method == "POST":
         selected = request.form.getlist('choices')
         if len(selected) != 5:
             flash("Please select exactly 5 games.")
-            return render_template("setup.html", items=items, selected=selected)
+            return render_template("setup.html", selected=selected, page_size=ITEMS_PAGE_SIZE)
         else:
-            save_user_selection_json(session['username'], selected)
+            catalog = get_catalog()
+            weights = selection_genre_weights(catalog.df, selected, catalog.item_index)
+            save_user_selection_json(session['username'], selected, catalog.fingerprint, weights)
             return redirect(url_for('home'))
 
     # For GET requests, try to load previous selections to keep them checked on reload
     user_selections = load_user_selection_json(session['username'])
-    return render_template("setup.html", items=items, selected=user_selections)
+    return conditional_page(
+        (session['username'], user_selections, ITEMS_PAGE_SIZE),
+        lambda: render_template("setup.html", selected=user_selections, page_size=ITEMS_PAGE_SIZE),
+    )
 
 
 
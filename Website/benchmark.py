@@ -0,0 +1,333 @@
+"""Benchmarks for the ranking, search and recommendation paths.
+
+Run from the repository root, e.g.
+
+    python Website/benchmark.py --sizes 1000 10000 100000 --output bench.json
+    python Website/benchmark.py --compare before.json after.json
+    python Website/benchmark.py --sizes --writes --output writes.json
+
+Each size gets a synthetic items.csv and synthetic users (see synthetic.py)
+in a temporary directory; the real catalog and user database are not
+touched. Every benchmark reports latency percentiles in milliseconds and
+the peak memory traced during one extra call. --compare prints the change
+between two result files and exits with status 1 when a p50 got slower by
+more than --threshold.
+
+--writes adds rating-write benchmarks: every user storage backend takes the
+same number of upsert_rating calls from 1, 8 and 32 concurrent threads, and
+the throughput and per-write latency percentiles are reported.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+import app as webapp
+from Backend import (get_personalized_blocks, get_personalized_blocks_with_ratings, get_top_genre_blocks,
+                     load_data, search_items, set_repository)
+from cache import CACHES
+from catalog import Catalog, set_catalog
+from storage import CachedRepository, LogRepository, SqliteRepository
+from synthetic import synthetic_repository, write_catalog
+
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+WRITE_THREADS = (1, 8, 32)
+
+# Rating-write backends: name -> function(workdir) returning a fresh repository
+WRITE_BACKENDS = {
+    'sqlite': lambda workdir: SqliteRepository(os.path.join(workdir, 'users.db')),
+    'sqlite+cache': lambda workdir: CachedRepository(SqliteRepository(os.path.join(workdir, 'users.db')), ttl=30),
+    'log': lambda workdir: LogRepository(os.path.join(workdir, 'log'), compact_interval=0),
+    'log[no fsync]': lambda workdir: LogRepository(os.path.join(workdir, 'log'), fsync=False, compact_interval=0),
+}
+
+# Benchmarks that rebuild the catalog are slow at 100k rows; they run fewer times
+SLOW_REPEAT = 3
+
+# Ignore p50 changes smaller than this many milliseconds in --compare
+MIN_DIFFERENCE_MS = 0.05
+
+
+def measure(fn, repeat, setup=None, warmup=1):
+    """Latency percentiles (ms) of fn() over `repeat` calls, plus its traced peak memory.
+
+    `setup`, when given, runs before every call and is not timed.
+    """
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        fn()
+
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000.0)
+
+    # Tracing slows every allocation down, so memory gets its own call
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings = np.array(timings)
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    return {
+        'runs': repeat,
+        'mean_ms': round(float(timings.mean()), 4),
+        'min_ms': round(float(timings.min()), 4),
+        'p50_ms': round(float(p50), 4),
+        'p95_ms': round(float(p95), 4),
+        'p99_ms': round(float(p99), 4),
+        'max_ms': round(float(timings.max()), 4),
+        'peak_kib': round(peak / 1024.0, 1),
+    }
+
+
+def _cycle(values):
+    # Endless round-robin over values, so repeated calls see different inputs
+    state = {'i': 0}
+
+    def next_value():
+        value = values[state['i'] % len(values)]
+        state['i'] += 1
+        return value
+    return next_value
+
+
+def _search_queries(df, n, seed):
+    # Whole words, prefixes and one-letter typos of game names
+    rng = np.random.default_rng(seed)
+    names = df['AppID'].astype(str).to_numpy()
+    queries = []
+    for name in rng.choice(names, size=n):
+        word = name.split()[0].lower()
+        kind = len(queries) % 3
+        if kind == 1:
+            word = word[:3]
+        elif kind == 2 and len(word) > 4:
+            word = word[:2] + word[3:]
+        queries.append(word)
+    return queries
+
+
+def _get(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError("GET %s returned %d" % (url, response.status_code))
+    return response
+
+
+def _clear_caches():
+    for cache in CACHES.values():
+        cache.clear()
+
+
+def run_size(n_rows, workdir, repeat=30, n_users=200, seed=0, log=print):
+    results = {}
+    path = write_catalog(os.path.join(workdir, 'items-%d.csv' % n_rows), n_rows, seed)
+    cache_dir = os.path.join(workdir, 'catalog-cache-%d' % n_rows)
+    model_path = os.path.join(workdir, 'genre-model-%d.npz' % n_rows)
+
+    def bench(name, fn, setup=None, runs=repeat):
+        results[name] = measure(fn, runs, setup)
+        log("  %-40s p50 %9.3f ms  p95 %9.3f ms  peak %9.1f KiB"
+            % (name, results[name]['p50_ms'], results[name]['p95_ms'], results[name]['peak_kib']))
+
+    log("%d rows" % n_rows)
+    bench('load_data', lambda: load_data(path), runs=SLOW_REPEAT)
+
+    def remove_cached_files():
+        if os.path.exists(model_path):
+            os.remove(model_path)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    bench('catalog_cold', lambda: Catalog(path, model_path, cache_dir).refresh(), remove_cached_files, runs=SLOW_REPEAT)
+    bench('catalog_warm', lambda: Catalog(path, model_path, cache_dir).refresh(), runs=SLOW_REPEAT)
+
+    catalog = Catalog(path, model_path, cache_dir).refresh()
+    df = catalog.df
+    repository = synthetic_repository(df, n_users, seed)
+    set_repository(repository)
+    set_catalog(catalog)
+    _clear_caches()
+
+    selections = list(repository.all_selections().values())
+    ratings_by_user = {}
+    for r in repository.all_ratings():
+        ratings_by_user.setdefault(r['username'], []).append(r)
+    user_ratings = [ratings for ratings in ratings_by_user.values() if ratings]
+    indexes = dict(genre_index=catalog.genre_index, genre_model=catalog.genre_model, item_index=catalog.item_index)
+
+    for sort_by in ('owners', 'rating'):
+        bench('get_top_genre_blocks[%s]' % sort_by,
+              lambda: get_top_genre_blocks(df, sort_by=sort_by, genre_index=catalog.genre_index))
+
+    next_selection = _cycle(selections)
+    bench('get_personalized_blocks', lambda: get_personalized_blocks(df, next_selection(), **indexes))
+    next_ratings = _cycle(user_ratings)
+    bench('get_personalized_blocks_with_ratings',
+          lambda: get_personalized_blocks_with_ratings(df, next_ratings(), **indexes))
+
+    next_query = _cycle(_search_queries(df, 100, seed))
+    bench('search_items', lambda: search_items(df, next_query(), catalog.search_index(), limit=webapp.SEARCH_LIMIT))
+
+    client = webapp.app.test_client()
+    bench('home[anonymous]', lambda: _get(client, '/'))
+    bench('home[anonymous,uncached]', lambda: _get(client, '/'), _clear_caches)
+    bench('home[search]', lambda: _get(client, '/?q=' + next_query()))
+
+    # The similar-games index is built once per catalog version, offline
+    start = time.perf_counter()
+    catalog.build_similar_items()
+    results['similar_items_build'] = {'runs': 1, 'p50_ms': round((time.perf_counter() - start) * 1000.0, 4)}
+    log("  %-40s %9.3f ms" % ('similar_items_build', results['similar_items_build']['p50_ms']))
+    next_item = _cycle(df['AppID'].astype(str).tolist()[::max(1, n_rows // 100)])
+    bench('item_page', lambda: _get(client, '/item/' + quote(next_item(), safe='')))
+
+    usernames = _cycle(sorted(repository.load_users()))
+
+    def log_in():
+        _clear_caches()
+        with client.session_transaction() as session:
+            session['username'] = usernames()
+    bench('home[user,uncached]', lambda: _get(client, '/'), log_in)
+    bench('home[user,uncached,rating]', lambda: _get(client, '/?filter=rating'), log_in)
+
+    with client.session_transaction() as session:
+        session.pop('username', None)
+    return results
+
+
+def run_writes(n_writes=2000, threads=WRITE_THREADS, log=print):
+    # Throughput of n_writes rating upserts split over each number of threads
+    results = {}
+    log("rating writes")
+    for name, make in WRITE_BACKENDS.items():
+        for n_threads in threads:
+            with tempfile.TemporaryDirectory(prefix='steam-writes-') as workdir:
+                repository = make(workdir)
+                latencies = [[] for _ in range(n_threads)]
+                start_barrier = threading.Barrier(n_threads + 1)
+
+                def writer(index):
+                    start_barrier.wait()
+                    for i in range(index, n_writes, n_threads):
+                        start = time.perf_counter()
+                        repository.upsert_rating('user%d' % (i % 500), 'game%d' % (i % 997), i % 5 + 1)
+                        latencies[index].append((time.perf_counter() - start) * 1000.0)
+
+                workers = [threading.Thread(target=writer, args=(index,)) for index in range(n_threads)]
+                for worker in workers:
+                    worker.start()
+                start_barrier.wait()
+                start = time.perf_counter()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.perf_counter() - start
+                if hasattr(repository, 'close'):
+                    repository.close()
+
+            timings = np.concatenate([np.array(values) for values in latencies])
+            p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+            key = 'upsert_rating[%s,%d threads]' % (name, n_threads)
+            results[key] = {
+                'runs': n_writes,
+                'writes_per_sec': round(n_writes / elapsed, 1),
+                'p50_ms': round(float(p50), 4),
+                'p95_ms': round(float(p95), 4),
+                'p99_ms': round(float(p99), 4),
+            }
+            log("  %-40s %9.0f writes/s  p50 %8.3f ms  p99 %8.3f ms"
+                % (key, results[key]['writes_per_sec'], p50, p99))
+    return results
+
+
+def run(sizes=DEFAULT_SIZES, repeat=30, n_users=200, seed=0, log=print, writes=False):
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'users': n_users,
+            'seed': seed,
+        },
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='steam-bench-') as workdir:
+        for n_rows in sizes:
+            report['results'][str(n_rows)] = run_size(n_rows, workdir, repeat, n_users, seed, log)
+    if writes:
+        report['results']['writes'] = run_writes(log=log)
+    return report
+
+
+def compare(before, after, threshold=0.1, log=print):
+    # Returns the (size, benchmark) pairs whose p50 regressed by more than threshold
+    regressions = []
+    log("%-8s %-40s %12s %12s %8s" % ('rows', 'benchmark', 'p50 before', 'p50 after', 'change'))
+    for size, benchmarks in after['results'].items():
+        for name, stats in benchmarks.items():
+            old = before['results'].get(size, {}).get(name)
+            if old is None:
+                continue
+            change = (stats['p50_ms'] - old['p50_ms']) / old['p50_ms'] if old['p50_ms'] else 0.0
+            slower = change > threshold and stats['p50_ms'] - old['p50_ms'] > MIN_DIFFERENCE_MS
+            if slower:
+                regressions.append((size, name))
+            log("%-8s %-40s %9.3f ms %9.3f ms %+7.1f%%%s"
+                % (size, name, old['p50_ms'], stats['p50_ms'], change * 100, '  REGRESSION' if slower else ''))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='*', type=int, default=list(DEFAULT_SIZES), help="catalog rows")
+    parser.add_argument('--writes', action='store_true', help="also benchmark concurrent rating writes")
+    parser.add_argument('--repeat', type=int, default=30, help="timed calls per benchmark")
+    parser.add_argument('--users', type=int, default=200, help="synthetic users per catalog")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help="compare two result files")
+    parser.add_argument('--threshold', type=float, default=0.1, help="allowed p50 slowdown in --compare")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            before = json.load(f)
+        with open(args.compare[1]) as f:
+            after = json.load(f)
+        regressions = compare(before, after, args.threshold)
+        print("%d regression(s)" % len(regressions))
+        return 1 if regressions else 0
+
+    report = run(args.sizes, args.repeat, args.users, args.seed, writes=args.writes)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print("Wrote", args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Every cache created here, by name, so their counters can be reported together
+CACHES = {}
+
+
+class TTLCache:
+    """Thread-safe cache whose entries expire after `ttl` seconds.
+
+    Each entry also remembers the version it was computed for (e.g. the
+    catalog version); asking for a different version is a miss. At most
+    `max_entries` are kept, dropping the oldest first.
+    """
+
+    def __init__(self, name, ttl=60, max_entries=128):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        CACHES[name] = self
+
+    def get(self, key, version=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, entry_version, value = entry
+                if entry_version == version and (expires is None or time.monotonic() < expires):
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, version=None):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, version, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def get_or_compute(self, key, compute, version=None):
+        value = self.get(key, version)
+        if value is None:
+            value = self.set(key, compute(), version)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+
+
+class LRUCache(TTLCache):
+    """TTLCache that evicts the least recently used entry instead of the oldest."""
+
+    def __init__(self, name, max_entries=1024, ttl=None):
+        super().__init__(name, ttl=ttl, max_entries=max_entries)
+
+    def get(self, key, version=None):
+        value = super().get(key, version)
+        if value is not None:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+        return value
+
+
+def cache_stats():
+    return {name: cache.stats() for name, cache in CACHES.items()}
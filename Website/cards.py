@@ -0,0 +1,27 @@
+from collections import namedtuple
+
+from instrumentation import timed
+
+
+# The few fields the list templates show for a game. 'AppID' holds the game
+# name in items.csv, so it is both the link key and the displayed name.
+GameCard = namedtuple('GameCard', ['appid', 'name', 'genres', 'owners', 'rating'])
+
+
+@timed('cards')
+def game_cards(df, rows, genre=None):
+    # GameCards for the given catalog row positions; `genre` replaces the
+    # genres shown, as the per-genre blocks do
+    names = df['AppID'].iloc[rows].astype(str).tolist()
+    genres = [genre] * len(names) if genre is not None else df['Genres'].iloc[rows].tolist()
+    owners = df['Estimated owners'].iloc[rows].tolist()
+    ratings = df['RatingPercent'].iloc[rows].tolist()
+    return [GameCard(*fields) for fields in zip(names, names, genres, owners, ratings)]
+
+
+def block_cards(df, genre_blocks, label_with_genre=False):
+    # {genre: row positions} -> {genre: [GameCard, ...]}
+    return {
+        genre: game_cards(df, rows, genre if label_with_genre else None)
+        for genre, rows in genre_blocks.items()
+    }
@@ -0,0 +1,210 @@
+import os
+import threading
+
+from Backend import BASE_DIR, ITEMS_CSV, load_data
+from genre_index import SORT_SCORES, GenreIndex, explode_genres, genres_from_codes
+from item_index import ItemIndex
+from instrumentation import timed
+from ingest import (CACHE_DIR, current_version_dir, file_fingerprint, ingest, load_columnar, load_genre_index,
+                    prepare_frame)
+from genre_model import GenreModel
+from scoring import compute_scores
+from search_index import SearchIndex
+from similar_items import SimilarItems
+
+
+GENRE_MODEL_NPZ = os.path.join(BASE_DIR, "genre_model.npz")
+
+class Catalog:
+    """Parsed items.csv plus its derived columns and indexes, for one version of the data.
+
+    refresh() returns the Catalog to serve: this one while neither items.csv
+    nor the published columnar cache (see ingest.py) changed, otherwise a
+    newly loaded Catalog. A loaded Catalog never changes, so a request that
+    holds one keeps a consistent view while another version is swapped in.
+
+    Numeric columns, scores, the genre index, the search index and the
+    similar-games index are memory-mapped from the cache version directory,
+    so every worker process shares one copy of them through the page cache.
+    """
+
+    def __init__(self, path=ITEMS_CSV, genre_model_path=GENRE_MODEL_NPZ, cache_dir=CACHE_DIR):
+        self.path = path
+        self.cache_dir = cache_dir
+        self.genre_model_path = genre_model_path
+        self.version = 0
+        self.fingerprint = None
+        self.version_dir = None
+        self.df = None
+        self.genre_index = None
+        self.genre_model = None
+        self.item_index = None
+        self._multi_valued = None
+        self._search_index = None
+        self._similar_items = None
+        self._stamp_loaded = None
+        self._successor = None
+        self._lock = threading.Lock()
+
+    def _stamp(self):
+        # Changes when items.csv is modified or a loader publishes a new cache version
+        current = current_version_dir(self.cache_dir) if self.cache_dir else None
+        return os.path.getmtime(self.path), current
+
+    def refresh(self):
+        stamp = self._stamp()
+        if stamp == self._stamp_loaded:
+            return self
+        with self._lock:
+            if self.df is None:
+                self._load(stamp)
+                return self
+            if self._successor is None:
+                successor = Catalog(self.path, self.genre_model_path, self.cache_dir)
+                successor.version = self.version
+                successor._load(stamp)
+                self._successor = successor
+        return self._successor.refresh()
+
+    def _load(self, stamp):
+        # Identifies the file version across processes and restarts
+        fingerprint = file_fingerprint(self.path)
+        df, multi_valued, version_dir = self._read(fingerprint)
+
+        missing_scores = [name for name in SORT_SCORES if name not in df]
+        if missing_scores:
+            compute_scores(df, missing_scores)
+
+        genre_index = load_genre_index(version_dir) if version_dir else None
+        if genre_index is None:
+            # One row per (game, genre), indexed by the game's row in df
+            if 'Genres' in multi_valued:
+                genres = genres_from_codes(*multi_valued['Genres'])
+            else:
+                genres = explode_genres(df)
+            genre_index = GenreIndex(df, genres)
+
+        self.df = df
+        self.genre_index = genre_index
+        self.genre_model = self._genre_model(df, fingerprint)
+        self.item_index = ItemIndex(df)
+        self._multi_valued = multi_valued
+        self.fingerprint = fingerprint
+        self.version_dir = version_dir
+        # The version directory actually read, not the one CURRENT named
+        # before: a version published meanwhile is picked up by the next
+        # refresh, and our own ingest above does not cause a second load
+        self._stamp_loaded = (stamp[0], version_dir or stamp[1])
+        self.version += 1
+
+    def _read(self, fingerprint):
+        # Memory-maps the columnar cache, (re)building it when items.csv changed
+        if self.cache_dir:
+            stored = load_columnar(self.cache_dir, fingerprint)
+            if stored is None:
+                try:
+                    ingest(self.path, self.cache_dir, fingerprint)
+                except OSError:
+                    pass
+                stored = load_columnar(self.cache_dir, fingerprint)
+            if stored is not None:
+                return stored
+        return prepare_frame(load_data(self.path)), {}, None
+
+    def _genre_model(self, df, fingerprint):
+        # Reuse the fitted TF-IDF model from disk when it matches this file version
+        if self.genre_model_path:
+            model = GenreModel.load(self.genre_model_path, fingerprint)
+            if model is not None:
+                return model
+        model = GenreModel.fit(df, fingerprint)
+        if self.genre_model_path:
+            try:
+                model.save(self.genre_model_path)
+            except OSError:
+                pass
+        return model
+
+    def search_index(self):
+        # The home page query index, loaded (or built and saved next to the
+        # columns) on the first search rather than on every catalog load
+        search_index = self._search_index
+        if search_index is None:
+            with self._lock:
+                search_index = self._search_index
+                if search_index is None:
+                    search_index = self._build_search_index()
+                    self._search_index = search_index
+        return search_index
+
+    def _build_search_index(self):
+        stem = os.path.join(self.version_dir, 'search_index') if self.version_dir else None
+        if stem:
+            search_index = SearchIndex.load(stem, self.df)
+            if search_index is not None:
+                return search_index
+        search_index = SearchIndex.build(self.df, multi_valued=self._multi_valued)
+        if stem:
+            try:
+                search_index.save(stem)
+            except OSError:
+                return search_index
+            search_index = SearchIndex.load(stem, self.df) or search_index
+        return search_index
+
+    def _similar_items_stem(self):
+        return os.path.join(self.version_dir, 'similar_items') if self.version_dir else None
+
+    def similar_items(self):
+        # Content neighbours of every game, or None until build_similar_items()
+        # has saved them for this version. Fitting them takes minutes on a
+        # large catalog, so requests only ever map the saved files.
+        similar_items = self._similar_items
+        if similar_items is None:
+            stem = self._similar_items_stem()
+            similar_items = SimilarItems.load(stem, len(self.df)) if stem else None
+            self._similar_items = similar_items
+        return similar_items
+
+    def build_similar_items(self):
+        # Run offline (precompute.py) once a version is published. A process
+        # that holds the catalog picks the files up on its next
+        # similar_items() call.
+        similar_items = self.similar_items()
+        if similar_items is not None:
+            return similar_items
+        similar_items = SimilarItems.fit(self.df, self._multi_valued)
+        stem = self._similar_items_stem()
+        if stem:
+            try:
+                similar_items.save(stem)
+            except OSError:
+                pass
+            else:
+                # Map the saved files, so this process shares their pages with the others
+                similar_items = SimilarItems.load(stem, len(self.df)) or similar_items
+        self._similar_items = similar_items
+        return similar_items
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+@timed('catalog')
+def get_catalog(path=ITEMS_CSV):
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = Catalog(path)
+    catalog = _catalog.refresh()
+    # Rebinding the name is atomic; requests already holding the old catalog finish with it
+    _catalog = catalog
+    return catalog
+
+
+def set_catalog(catalog):
+    # Swap the served catalog, e.g. a Catalog over a synthetic items.csv in benchmarks
+    global _catalog
+    _catalog = catalog
@@ -0,0 +1,100 @@
+import numpy as np
+from scipy import sparse
+
+from instrumentation import timed
+from topk import top_k
+
+
+# Ratings are centred on the middle of the 1-5 scale, so 1-2 stars push
+# neighbours down and 3-5 stars pull them up
+RATING_MIDPOINT = 2.5
+
+
+class ItemItemRecommender:
+    """Item-item collaborative filtering over the stored user ratings.
+
+    Builds a sparse user x item matrix (items are catalog row positions),
+    computes item-item cosine similarity and keeps only the top
+    `n_neighbours` per item. A user's scores are then one sparse
+    vector-matrix product with that neighbour matrix.
+    """
+
+    def __init__(self, neighbours, item_positions):
+        self.neighbours = neighbours
+        self.item_positions = item_positions
+
+    @classmethod
+    @timed('cf_fit')
+    def fit(cls, df, ratings, n_neighbours=50, item_positions=None):
+        # item_positions: AppID string -> row position, e.g. catalog.item_index.positions
+        if item_positions is None:
+            item_positions = {str(appid): i for i, appid in enumerate(df['AppID'])}
+        n_items = len(df)
+
+        users = {}
+        rows, cols, values = [], [], []
+        for r in ratings:
+            position = item_positions.get(str(r['appid']))
+            if position is None:
+                continue
+            rows.append(users.setdefault(r['username'], len(users)))
+            cols.append(position)
+            values.append(float(r['rating']) - RATING_MIDPOINT)
+
+        matrix = sparse.csr_matrix((values, (rows, cols)), shape=(len(users), n_items))
+        matrix.sum_duplicates()
+
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+        norms[norms == 0] = 1.0
+        normalized = matrix @ sparse.diags(1.0 / norms)
+        similarity = (normalized.T @ normalized).tocsr()
+        similarity.setdiag(0)
+        similarity.eliminate_zeros()
+
+        return cls(_keep_top_n(similarity, n_neighbours), item_positions)
+
+    def scores(self, user_ratings):
+        # Returns (scores over all items, positions the user already rated)
+        cols, values = [], []
+        for r in user_ratings:
+            position = self.item_positions.get(str(r['appid']))
+            if position is not None:
+                cols.append(position)
+                values.append(float(r['rating']) - RATING_MIDPOINT)
+        n_items = self.neighbours.shape[0]
+        if not cols:
+            return np.zeros(n_items), np.empty(0, dtype='int64')
+        user_vector = sparse.csr_matrix((values, ([0] * len(cols), cols)), shape=(1, n_items))
+        scores = (user_vector @ self.neighbours).toarray().ravel()
+        return scores, np.array(cols, dtype='int64')
+
+    def recommend(self, user_ratings, n=20, exclude=None):
+        # Catalog row positions, best first; only items with a positive score.
+        # exclude: optional boolean mask of rows that must not be recommended
+        scores, rated = self.scores(user_ratings)
+        scores[rated] = 0
+        if exclude is not None:
+            scores[exclude] = 0
+        return top_k(scores, n, exclude=scores <= 0)
+
+
+def _keep_top_n(similarity, n):
+    # Row-wise pruning of a CSR similarity matrix to its n largest entries
+    indptr = [0]
+    indices = []
+    data = []
+    for row in range(similarity.shape[0]):
+        start, end = similarity.indptr[row], similarity.indptr[row + 1]
+        row_data = similarity.data[start:end]
+        row_indices = similarity.indices[start:end]
+        if len(row_data) > n:
+            keep = np.argpartition(-row_data, n)[:n]
+            row_data = row_data[keep]
+            row_indices = row_indices[keep]
+        data.append(row_data)
+        indices.append(row_indices)
+        indptr.append(indptr[-1] + len(row_data))
+    return sparse.csr_matrix(
+        (np.concatenate(data) if data else [], np.concatenate(indices) if indices else [], indptr),
+        shape=similarity.shape,
+    )
@@ -0,0 +1,152 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from scoring import SCORERS
+from topk import intersect_ranked
+
+
+SORT_COLUMNS = {
+    'owners': 'Estimated owners',
+    'rating': 'RatingPercent',
+    'wilson': 'WilsonScore',
+    'bayesian': 'BayesianRating',
+}
+
+# The scoring.SCORERS columns a catalog needs for SORT_COLUMNS
+SORT_SCORES = [column for column in SORT_COLUMNS.values() if column in SCORERS]
+
+
+def explode_genres(df):
+    # One entry per (game, genre), indexed by the game's row position in df
+    genres = df['Genres'].fillna('').str.split(',').explode().str.strip()
+    genres.index = np.repeat(np.arange(len(df)), df['Genres'].fillna('').str.split(',').str.len())
+    return genres[genres != '']
+
+
+def genres_from_codes(vocabulary, codes, offsets):
+    # Same as explode_genres, from the dictionary-encoded column built at ingest
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    return pd.Series(np.asarray(vocabulary, dtype=object)[codes], index=rows)
+
+
+class GenreIndex:
+    """Genre -> row-position inverted index over a catalog DataFrame.
+
+    Every posting list is kept pre-sorted (descending, ties in row order) for
+    each key in SORT_COLUMNS, so the top K games of a genre are a prefix slice
+    and multi-genre blocks are an ordered intersection of the lists that
+    stops after K matches.
+    """
+
+    def __init__(self, df, genres=None):
+        if genres is None:
+            genres = explode_genres(df)
+
+        rows = genres.index.to_numpy()
+        names = genres.to_numpy()
+
+        keys = {}
+        for sort_by, column in SORT_COLUMNS.items():
+            if column in df:
+                keys[sort_by] = df[column].to_numpy()
+            else:
+                keys[sort_by] = SCORERS[column](df['Positive'].to_numpy(), df['Negative'].to_numpy())
+
+        # Rank of every row under each key; sorting postings by rank keeps one global order
+        self._ranks = {}
+        for sort_by, values in keys.items():
+            order = np.argsort(-values, kind='stable')
+            ranks = np.empty(len(order), dtype='int64')
+            ranks[order] = np.arange(len(order))
+            self._ranks[sort_by] = ranks
+
+        self.postings = {}
+        self._sorted = {sort_by: {} for sort_by in keys}
+        self._sorted_ranks = {sort_by: {} for sort_by in keys}
+        by_genre = pd.Series(rows).groupby(names, sort=False)
+        for genre, positions in by_genre:
+            positions = np.unique(positions.to_numpy())
+            self.postings[genre] = positions
+            for sort_by, ranks in self._ranks.items():
+                ordered = positions[np.argsort(ranks[positions], kind='stable')]
+                self._sorted[sort_by][genre] = ordered
+                self._sorted_ranks[sort_by][genre] = ranks[ordered]
+
+        self.genre_totals = (
+            pd.Series(keys['owners'][rows].astype('int64')).groupby(names).sum().sort_values(ascending=False)
+        )
+
+    def save(self, stem):
+        # Flat arrays plus per-genre offsets, so load() can memory-map them
+        genres = list(self.postings)
+        offsets = np.zeros(len(genres) + 1, dtype='int64')
+        np.cumsum([len(self.postings[genre]) for genre in genres], out=offsets[1:])
+
+        def flat(lists):
+            return np.concatenate([lists[genre] for genre in genres]) if genres else np.zeros(0, dtype='int64')
+
+        np.save(stem + '.offsets.npy', offsets)
+        np.save(stem + '.postings.npy', flat(self.postings))
+        for sort_by, ranks in self._ranks.items():
+            np.save('%s.%s.ranks.npy' % (stem, sort_by), ranks)
+            np.save('%s.%s.sorted.npy' % (stem, sort_by), flat(self._sorted[sort_by]))
+            np.save('%s.%s.sorted_ranks.npy' % (stem, sort_by), flat(self._sorted_ranks[sort_by]))
+        with open(stem + '.json', 'w') as f:
+            json.dump({
+                'genres': genres,
+                'sort_by': list(self._ranks),
+                'totals': [[genre, int(total)] for genre, total in self.genre_totals.items()],
+            }, f)
+
+    @classmethod
+    def load(cls, stem, mmap_mode='r'):
+        # Index saved by save(); posting lists are views into the mapped files.
+        # None when nothing was saved under `stem`.
+        if not os.path.isfile(stem + '.json'):
+            return None
+        with open(stem + '.json') as f:
+            meta = json.load(f)
+        genres = meta['genres']
+        offsets = np.load(stem + '.offsets.npy').tolist()
+
+        def split(flat):
+            return {genre: flat[offsets[i]:offsets[i + 1]] for i, genre in enumerate(genres)}
+
+        index = cls.__new__(cls)
+        index.postings = split(np.load(stem + '.postings.npy', mmap_mode=mmap_mode))
+        index._ranks = {}
+        index._sorted = {}
+        index._sorted_ranks = {}
+        for sort_by in meta['sort_by']:
+            index._ranks[sort_by] = np.load('%s.%s.ranks.npy' % (stem, sort_by), mmap_mode=mmap_mode)
+            index._sorted[sort_by] = split(np.load('%s.%s.sorted.npy' % (stem, sort_by), mmap_mode=mmap_mode))
+            index._sorted_ranks[sort_by] = split(
+                np.load('%s.%s.sorted_ranks.npy' % (stem, sort_by), mmap_mode=mmap_mode)
+            )
+        totals = meta['totals']
+        index.genre_totals = pd.Series([total for _, total in totals], index=[genre for genre, _ in totals],
+                                       dtype='int64')
+        return index
+
+    def top_genres(self, n=10):
+        return self.genre_totals.head(n).index.tolist()
+
+    def top_rows(self, genre, sort_by='owners', n=20, exclude=None):
+        # exclude: optional boolean mask over the rows, applied before the cut
+        rows = self._sorted[sort_by].get(genre)
+        if rows is None:
+            return np.empty(0, dtype='int64')
+        if exclude is not None:
+            rows = rows[~exclude[rows]]
+        return rows[:n]
+
+    def rows_with_all(self, genres, sort_by='owners', n=20, exclude=None):
+        # Games tagged with every genre in `genres`, best first
+        lists = [self._sorted[sort_by].get(genre) for genre in genres]
+        if not lists or any(rows is None for rows in lists):
+            return np.empty(0, dtype='int64')
+        rank_lists = [self._sorted_ranks[sort_by][genre] for genre in genres]
+        return intersect_ranked(lists, rank_lists, n, exclude)
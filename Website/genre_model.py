@@ -0,0 +1,97 @@
+import os
+import zipfile
+import zlib
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from instrumentation import timed
+from npy_files import write_atomic
+from topk import top_k
+
+
+class GenreModel:
+    """TF-IDF vectors of the catalog's distinct genre strings, fitted once.
+
+    Rows of `matrix` are L2-normalised, so cosine similarity against a user
+    vector is a single sparse dot product.
+    """
+
+    def __init__(self, genres, vectorizer, matrix, fingerprint=''):
+        self.genres = genres
+        self.vectorizer = vectorizer
+        self.matrix = matrix
+        self.fingerprint = fingerprint
+        self._genre_terms = {}
+
+    @classmethod
+    def fit(cls, df, fingerprint=''):
+        genres = df['Genres'].fillna('').unique()
+        vectorizer = TfidfVectorizer()
+        matrix = vectorizer.fit_transform(genres).tocsr()
+        return cls(genres, vectorizer, matrix, fingerprint)
+
+    def _terms(self, genre):
+        # Vocabulary indices of the tokens in one genre name, memoized
+        terms = self._genre_terms.get(genre)
+        if terms is None:
+            vocabulary = self.vectorizer.vocabulary_
+            analyzer = self.vectorizer.build_analyzer()
+            terms = [vocabulary[token] for token in analyzer(genre) if token in vocabulary]
+            self._genre_terms[genre] = terms
+        return terms
+
+    def query_vector(self, weights):
+        # TF-IDF vector of a {genre: weight} profile, as if each genre name
+        # occurred `weight` times in the query text
+        vector = np.zeros(self.matrix.shape[1])
+        for genre, weight in weights.items():
+            for term in self._terms(genre):
+                vector[term] += weight
+        vector *= self.vectorizer.idf_
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    @timed('tfidf')
+    def similar_genres_for_weights(self, weights, top_n=10):
+        sim_scores = self.matrix @ self.query_vector(weights)
+        top_indices = top_k(sim_scores, top_n)
+        return [self.genres[i] for i in top_indices if self.genres[i].strip() != '']
+
+    def save(self, path):
+        vocabulary = self.vectorizer.vocabulary_
+        terms = np.array(sorted(vocabulary, key=vocabulary.get))
+        write_atomic(path, lambda f: np.savez_compressed(
+            f,
+            genres=np.asarray(self.genres, dtype=str),
+            terms=terms,
+            idf=self.vectorizer.idf_,
+            data=self.matrix.data,
+            indices=self.matrix.indices,
+            indptr=self.matrix.indptr,
+            shape=np.array(self.matrix.shape),
+            fingerprint=np.array(self.fingerprint),
+        ))
+
+    @classmethod
+    def load(cls, path, fingerprint=None):
+        # Returns None when the file is missing, unreadable or was fitted on
+        # another catalog version, so the caller refits and rewrites it
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as stored:
+                if fingerprint is not None and str(stored['fingerprint']) != fingerprint:
+                    return None
+                terms = stored['terms'].tolist()
+                vectorizer = TfidfVectorizer(vocabulary={term: i for i, term in enumerate(terms)})
+                vectorizer.idf_ = stored['idf']
+                matrix = sparse.csr_matrix(
+                    (stored['data'], stored['indices'], stored['indptr']),
+                    shape=tuple(stored['shape']),
+                )
+                genres = stored['genres'].astype(object)
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile, zlib.error):
+            return None
+        return cls(genres, vectorizer, matrix, str(fingerprint or ''))
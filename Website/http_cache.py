@@ -0,0 +1,153 @@
+"""Conditional GETs and compression for the rendered pages and JSON responses.
+
+Pages get a weak ETag computed from what they are rendered from (the catalog
+file version, the user's data, the query string...), so a request carrying a
+matching If-None-Match is answered 304 before anything is rendered. Bodies
+are cached per (ETag, content coding): a page another visitor already asked
+for is served without rendering or compressing it again.
+"""
+import gzip
+import hashlib
+import os
+
+from flask import current_app, request, session
+
+from cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Responses smaller than this are sent as they are
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = ('text/html', 'text/css', 'text/plain', 'application/json', 'application/javascript',
+                      'text/javascript')
+
+# Encoded page bodies by (etag, coding); the ETag already covers every input of the page
+page_bodies = LRUCache('page_bodies', max_entries=512)
+
+# Compressed static files by (path, mtime, size, coding)
+static_bodies = LRUCache('static_bodies', max_entries=128)
+
+
+_templates_versions = {}
+
+
+def _templates_version(folder):
+    # Part of every ETag, so a deploy with changed templates does not answer 304 with stale pages
+    version = _templates_versions.get(folder)
+    if version is None:
+        mtimes = []
+        for root, _, files in os.walk(folder):
+            mtimes.extend(os.path.getmtime(os.path.join(root, name)) for name in files)
+        version = _templates_versions[folder] = repr(max(mtimes, default=0))
+    return version
+
+
+def page_etag(*parts):
+    folder = os.path.join(current_app.root_path, current_app.template_folder)
+    digest = hashlib.blake2b(repr((_templates_version(folder),) + parts).encode('utf-8'), digest_size=12)
+    return digest.hexdigest()
+
+
+def accepted_coding():
+    # Best content coding the client accepts: 'br', 'gzip' or 'identity'
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return 'identity'
+
+
+def encode(data, coding):
+    if coding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    if coding == 'gzip':
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    return data
+
+
+def _cacheable():
+    # A page with flashed messages is shown once and must not be cached
+    return '_flashes' not in session
+
+
+def conditional_page(etag_parts, render, mimetype='text/html'):
+    """Response for a GET whose body is fully determined by etag_parts.
+
+    render() builds the body (str or bytes) and only runs when neither the
+    client nor page_bodies has it.
+    """
+    response_class = current_app.response_class
+    if not _cacheable():
+        return response_class(render(), mimetype=mimetype)
+
+    etag = page_etag(request.path, *etag_parts)
+    if request.if_none_match.contains_weak(etag):
+        response = response_class(status=304)
+    else:
+        coding = accepted_coding()
+        body = page_bodies.get((etag, coding))
+        if body is None:
+            data = render()
+            data = data.encode('utf-8') if isinstance(data, str) else data
+            if coding != 'identity' and len(data) < MIN_COMPRESS_BYTES:
+                coding = 'identity'
+            body = page_bodies.set((etag, coding), encode(data, coding))
+        response = response_class(body, mimetype=mimetype)
+        if coding != 'identity':
+            response.headers['Content-Encoding'] = coding
+    response.set_etag(etag, weak=True)
+    # Cached by the browser, but revalidated with the ETag on every use
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def compress_response(response):
+    # Compresses other responses worth it, e.g. /api/items pages and static files
+    if (response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES or request.method == 'HEAD'):
+        return response
+    coding = accepted_coding()
+    if coding == 'identity':
+        return response
+
+    if request.endpoint == 'static':
+        path = os.path.join(current_app.static_folder, request.view_args.get('filename', ''))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return response
+        key = (path, stat.st_mtime, stat.st_size, coding)
+        body = static_bodies.get(key)
+        if body is None:
+            response.direct_passthrough = False
+            body = static_bodies.set(key, encode(response.get_data(), coding))
+        else:
+            close = getattr(response.response, 'close', None)
+            if close is not None:
+                close()
+        # Flask's ETag and Last-Modified stay; the ETag becomes weak as it now covers two encodings
+        etag, _ = response.get_etag()
+        if etag:
+            response.set_etag(etag, weak=True)
+    else:
+        if response.direct_passthrough or response.is_streamed:
+            return response
+        data = response.get_data()
+        if len(data) < MIN_COMPRESS_BYTES:
+            return response
+        body = encode(data, coding)
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = coding
+    response.vary.add('Accept-Encoding')
+    return response
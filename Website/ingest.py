@@ -0,0 +1,297 @@
+"""Convert items.csv into a typed, memory-mappable columnar cache.
+
+    python Website/ingest.py
+
+The owner ranges ("20000 - 50000") are parsed into numeric OwnersLow,
+OwnersHigh and OwnersMid columns, integer columns are narrowed to int32
+where their values fit, and text columns with many repeated values become
+categoricals.
+
+Every column is stored as its own .npy file: numeric columns as-is,
+categoricals as integer codes plus their categories, and other text columns
+as one UTF-8 buffer plus offsets. The multi-valued columns (Genres, Tags,
+Categories) are also stored pre-split and dictionary-encoded: a vocabulary,
+int32 codes and per-row offsets into the codes.
+
+The scores the catalog sorts by (genre_index.SORT_SCORES) are stored as
+ordinary numeric columns, and the genre index (genre_index.GenreIndex) as flat arrays, so a
+process serving the catalog maps them instead of recomputing its own copy.
+All worker processes then share the same pages through the OS page cache.
+
+Each ingest writes a fresh version directory and then atomically repoints
+the CURRENT file at it, so readers never see a half-written cache. Running
+processes notice the new CURRENT on their next catalog refresh and switch
+over without a restart (see catalog.Catalog.refresh).
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype, is_numeric_dtype
+
+from Backend import BASE_DIR, ITEMS_CSV, load_data
+from genre_index import SORT_SCORES, GenreIndex, genres_from_codes
+from npy_files import write_atomic
+from scoring import compute_scores
+
+
+CACHE_DIR = os.path.join(BASE_DIR, "catalog_cache")
+
+FORMAT_VERSION = 4
+
+MULTI_VALUED_COLUMNS = ('Genres', 'Tags', 'Categories')
+
+# Text columns stored as categoricals when at most this share of their values is distinct
+CATEGORY_MAX_DISTINCT = 0.5
+
+# Columns that stay plain text: unique ids, and the multi-valued columns that
+# callers still split and fill as strings
+PLAIN_TEXT_COLUMNS = ('AppID',) + MULTI_VALUED_COLUMNS
+
+_OWNER_RANGE_RE = r'^\s*(\d+)\s*-\s*(\d+)\s*$'
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return '%r:%d' % (stat.st_mtime, stat.st_size)
+
+
+def owner_range_column(df):
+    # items.csv has its header shifted by one column ('AppID' holds the game
+    # name), so the "low - high" owner ranges end up under 'Release date';
+    # a correctly labelled file keeps them under 'Estimated owners'.
+    for column in ('Estimated owners', 'Release date'):
+        if column in df and not is_numeric_dtype(df[column]):
+            if df[column].astype(str).str.match(_OWNER_RANGE_RE).mean() > 0.5:
+                return column
+    return None
+
+
+def compact_int(values):
+    values = np.asarray(values)
+    info = np.iinfo('int32')
+    if len(values) == 0 or (values.min() >= info.min and values.max() <= info.max):
+        return values.astype('int32')
+    return values.astype('int64')
+
+
+def parse_owner_ranges(series):
+    # "1000000 - 2000000" -> (1000000, 2000000); anything unparsable becomes 0
+    parts = series.astype(str).str.extract(_OWNER_RANGE_RE)
+    low = pd.to_numeric(parts[0], errors='coerce').fillna(0).astype('int64').to_numpy()
+    high = pd.to_numeric(parts[1], errors='coerce').fillna(0).astype('int64').to_numpy()
+    return low, high
+
+
+def prepare_frame(df):
+    # Numeric owner columns, narrow integers and categoricals for repeated text
+    column = owner_range_column(df)
+    if column is not None:
+        low, high = parse_owner_ranges(df[column])
+        df['OwnersLow'] = compact_int(low)
+        df['OwnersHigh'] = compact_int(high)
+        df['OwnersMid'] = compact_int((low + high) // 2)
+
+    for column in df.columns:
+        values = df[column]
+        if is_integer_dtype(values):
+            df[column] = compact_int(values.to_numpy())
+        elif not is_numeric_dtype(values) and column not in PLAIN_TEXT_COLUMNS and len(values):
+            if values.nunique(dropna=True) <= CATEGORY_MAX_DISTINCT * len(values):
+                df[column] = values.astype('category')
+    return df
+
+
+def split_multi_valued(series):
+    # Comma-joined strings -> (vocabulary, int32 codes, int64 row offsets)
+    lists = [[value.strip() for value in text.split(',') if value.strip()] if isinstance(text, str) else []
+             for text in series.tolist()]
+    offsets = np.zeros(len(lists) + 1, dtype='int64')
+    np.cumsum([len(values) for values in lists], out=offsets[1:])
+    flat = [value for values in lists for value in values]
+    if not flat:
+        return np.array([], dtype=object), np.zeros(0, dtype='int32'), offsets
+    vocabulary, codes = np.unique(np.array(flat, dtype=object), return_inverse=True)
+    return vocabulary, codes.astype('int32'), offsets
+
+
+def _save_strings(stem, values):
+    values = list(values)
+    missing = np.array([not isinstance(value, str) for value in values], dtype=bool)
+    encoded = [b'' if is_missing else value.encode('utf-8') for value, is_missing in zip(values, missing)]
+    offsets = np.zeros(len(encoded) + 1, dtype='int64')
+    np.cumsum([len(chunk) for chunk in encoded], out=offsets[1:])
+    np.save(stem + '.data.npy', np.frombuffer(b''.join(encoded), dtype='uint8'))
+    np.save(stem + '.offsets.npy', offsets)
+    np.save(stem + '.missing.npy', missing)
+
+
+def _load_strings(stem, mmap_mode='r'):
+    data = np.load(stem + '.data.npy', mmap_mode=mmap_mode).tobytes()
+    offsets = np.load(stem + '.offsets.npy', mmap_mode=mmap_mode).tolist()
+    missing = np.load(stem + '.missing.npy', mmap_mode=mmap_mode)
+    values = np.empty(len(offsets) - 1, dtype=object)
+    for i in range(len(values)):
+        values[i] = data[offsets[i]:offsets[i + 1]].decode('utf-8')
+    values[missing] = np.nan
+    return values
+
+
+def ingest(csv_path=ITEMS_CSV, cache_dir=CACHE_DIR, fingerprint=None):
+    fingerprint = fingerprint or file_fingerprint(csv_path)
+    df = compute_scores(prepare_frame(load_data(csv_path)), SORT_SCORES)
+
+    name = 'v-' + hashlib.sha1(('%d:%s' % (FORMAT_VERSION, fingerprint)).encode('utf-8')).hexdigest()[:16]
+    version_dir = os.path.join(cache_dir, name)
+    tmp_dir = '%s.tmp-%d' % (version_dir, os.getpid())
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    meta = {
+        'format': FORMAT_VERSION,
+        'fingerprint': fingerprint,
+        'rows': len(df),
+        'columns': [],
+        'multi_valued': [],
+        'genre_index': None,
+    }
+    for i, column in enumerate(df.columns):
+        stem = 'col%03d' % i
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp_dir, stem + '.codes.npy'), df[column].cat.codes.to_numpy())
+            _save_strings(os.path.join(tmp_dir, stem + '.categories'), df[column].cat.categories)
+            kind = 'category'
+        elif is_numeric_dtype(df[column]):
+            np.save(os.path.join(tmp_dir, stem + '.npy'), df[column].to_numpy())
+            kind = 'numeric'
+        else:
+            _save_strings(os.path.join(tmp_dir, stem), df[column])
+            kind = 'string'
+        meta['columns'].append({'name': column, 'kind': kind, 'file': stem})
+
+    for i, column in enumerate(MULTI_VALUED_COLUMNS):
+        if column not in df:
+            continue
+        stem = 'multi%03d' % i
+        vocabulary, codes, offsets = split_multi_valued(df[column])
+        _save_strings(os.path.join(tmp_dir, stem + '.vocabulary'), vocabulary)
+        np.save(os.path.join(tmp_dir, stem + '.codes.npy'), codes)
+        np.save(os.path.join(tmp_dir, stem + '.offsets.npy'), offsets)
+        meta['multi_valued'].append({'name': column, 'file': stem})
+        if column == 'Genres':
+            GenreIndex(df, genres_from_codes(vocabulary, codes, offsets)).save(os.path.join(tmp_dir, 'genre_index'))
+            meta['genre_index'] = 'genre_index'
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    try:
+        os.replace(tmp_dir, version_dir)
+    except OSError:
+        # Another process published the same version first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(version_dir):
+            raise
+    _set_current(cache_dir, name)
+    _remove_stale_versions(cache_dir, name)
+    return version_dir
+
+
+def _set_current(cache_dir, name):
+    write_atomic(os.path.join(cache_dir, 'CURRENT'), lambda f: f.write(name), mode='w')
+
+
+def _pid_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to someone else, or the platform cannot tell
+        return True
+    return True
+
+
+def _remove_stale_versions(cache_dir, current):
+    # Processes still mapping an old version keep their pages until they
+    # reload. Temporary copies are left to their writer while it runs.
+    for entry in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, entry)
+        if '.tmp-' in entry:
+            pid = entry.rsplit('.tmp-', 1)[1]
+            if pid.isdigit() and not _pid_running(int(pid)):
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        elif entry.startswith('v-') and entry != current:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def current_version_dir(cache_dir=CACHE_DIR):
+    try:
+        with open(os.path.join(cache_dir, 'CURRENT')) as f:
+            return os.path.join(cache_dir, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def load_columnar(cache_dir=CACHE_DIR, fingerprint=None):
+    """Returns (df, multi_valued, version_dir) from the current cache, or None
+    if it is missing, of another format, or built from a different CSV
+    fingerprint.
+
+    multi_valued maps column name -> (vocabulary, codes, offsets); numeric
+    columns are memory-mapped read-only. version_dir is the directory that
+    was read, for the derived files stored next to the columns.
+    """
+    version_dir = current_version_dir(cache_dir)
+    if version_dir is None:
+        return None
+    try:
+        with open(os.path.join(version_dir, 'meta.json')) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+    if meta['format'] != FORMAT_VERSION or (fingerprint is not None and meta['fingerprint'] != fingerprint):
+        return None
+
+    columns = {}
+    for column in meta['columns']:
+        stem = os.path.join(version_dir, column['file'])
+        if column['kind'] == 'numeric':
+            columns[column['name']] = np.load(stem + '.npy', mmap_mode='r')
+        elif column['kind'] == 'category':
+            columns[column['name']] = pd.Categorical.from_codes(
+                np.load(stem + '.codes.npy', mmap_mode='r'), _load_strings(stem + '.categories')
+            )
+        else:
+            columns[column['name']] = _load_strings(stem)
+    df = pd.DataFrame(columns, copy=False)
+
+    multi_valued = {}
+    for column in meta['multi_valued']:
+        stem = os.path.join(version_dir, column['file'])
+        multi_valued[column['name']] = (
+            _load_strings(stem + '.vocabulary'),
+            np.load(stem + '.codes.npy', mmap_mode='r'),
+            np.load(stem + '.offsets.npy', mmap_mode='r'),
+        )
+    return df, multi_valued, version_dir
+
+
+def load_genre_index(version_dir):
+    # The GenreIndex saved by ingest(), memory-mapped; None for an older cache
+    with open(os.path.join(version_dir, 'meta.json')) as f:
+        name = json.load(f).get('genre_index')
+    return GenreIndex.load(os.path.join(version_dir, name)) if name else None
+
+
+if __name__ == "__main__":
+    print("Wrote", ingest())
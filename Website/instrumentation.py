@@ -0,0 +1,174 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Per-request stage timings: {stage: [seconds, calls]}, or None when the
+# current request (or thread) is not being timed
+_timings = contextvars.ContextVar('stage_timings', default=None)
+
+
+def start_timings():
+    return _timings.set({})
+
+
+def stop_timings(token):
+    timings = _timings.get()
+    _timings.reset(token)
+    return timings or {}
+
+
+def timing_active():
+    return _timings.get() is not None
+
+
+def record(name, seconds):
+    # Adds `seconds` to stage `name` of the current request, if it is timed
+    timings = _timings.get()
+    if timings is not None:
+        entry = timings.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+        STAGE_SECONDS.inc(seconds, (name,))
+
+
+@contextmanager
+def stage(name):
+    # Times the enclosed block as `name`; stages nest, so times are inclusive
+    if _timings.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def timed(name):
+    # Decorator form of stage(); a single context lookup when timing is off
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _timings.get() is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def server_timing_header(timings, total=None):
+    # Value of a Server-Timing response header, durations in milliseconds
+    parts = []
+    for name, (seconds, calls) in timings.items():
+        part = '%s;dur=%.3f' % (name, seconds * 1000.0)
+        if calls > 1:
+            part += ';desc="%d calls"' % calls
+        parts.append(part)
+    if total is not None:
+        parts.append('total;dur=%.3f' % (total * 1000.0))
+    return ', '.join(parts)
+
+
+# Every metric created here, by name, in the order they are rendered
+METRICS = {}
+
+# Request latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join('%s="%s"' % (name, value) for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """Monotonic counter per label set, rendered in Prometheus text format."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        METRICS[name] = self
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, (), value) for labels, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, rendered in Prometheus text format."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        METRICS[name] = self
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[labels] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                samples.append((self.name + '_bucket', labels, (('le', le),), cumulative))
+            samples.append((self.name + '_sum', labels, (), total))
+            samples.append((self.name + '_count', labels, (), cumulative))
+        return samples
+
+
+def render_metrics():
+    # All metrics in the Prometheus text exposition format (version 0.0.4)
+    lines = []
+    for metric in list(METRICS.values()):
+        lines.append('# HELP %s %s' % (metric.name, metric.help_text))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        for name, labels, extra, value in metric.samples():
+            lines.append('%s%s %s' % (name, _format_labels(metric.labels, labels, extra), _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time spent handling a request, by route.', ('route', 'method')
+)
+REQUESTS = Counter('http_requests_total', 'Requests handled, by route and status.', ('route', 'method', 'status'))
+STAGE_SECONDS = Counter(
+    'app_stage_seconds_total', 'Time spent in instrumented stages of timed requests.', ('stage',)
+)
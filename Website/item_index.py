@@ -0,0 +1,36 @@
+import numpy as np
+
+
+class ItemIndex:
+    """Hash index from item key to catalog row position.
+
+    The key is the string form of the 'AppID' column (which holds the game
+    name in items.csv). When a key occurs twice, its first row wins.
+    """
+
+    def __init__(self, df):
+        self.keys = df['AppID'].astype(str).tolist()
+        self.positions = {}
+        for row, key in enumerate(self.keys):
+            self.positions.setdefault(key, row)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return str(key) in self.positions
+
+    def position(self, key):
+        # Row position of `key`, or None when the catalog has no such item
+        return self.positions.get(str(key))
+
+    def rows(self, keys):
+        # Row positions of the known keys, in the order given
+        positions = (self.positions.get(str(key)) for key in keys)
+        return np.array([row for row in positions if row is not None], dtype='int64')
+
+    def mask(self, keys):
+        # Boolean mask over the catalog rows, True for the given keys
+        mask = np.zeros(len(self.keys), dtype=bool)
+        mask[self.rows(keys)] = True
+        return mask
@@ -0,0 +1,491 @@
+"""Load test of the web app's routes over HTTP on localhost.
+
+Run from the repository root, e.g.
+
+    python Website/loadtest.py --rows 10000 --concurrency 1 8 32 --duration 10
+    python Website/loadtest.py --workers 4 --model asyncio --revalidate --gzip --output load.json
+    python Website/benchmark.py --compare before.json load.json
+
+As in benchmark.py, the app serves a synthetic items.csv and synthetic users
+(see synthetic.py) from a temporary directory; the real catalog and user
+database are not touched. The app runs in --workers forked processes that
+share one listening socket, each a threaded werkzeug server, so the load
+generator does not compete with it for the GIL.
+
+Clients are closed-loop: each of --concurrency threads (or asyncio tasks
+with --model asyncio) sends its next request as soon as the previous one is
+answered, over a keep-alive connection, drawing routes from the weighted
+MIX. For every concurrency level the report gives, per route and overall,
+the throughput, the p50/p95/p99 latency in milliseconds and the error rate.
+A request is an error when it fails or its status is not the expected one
+(200 or 304 for pages, 302 for a submitted review); the exit status is 1
+when any level had errors.
+
+--revalidate makes clients behave like a browser cache and send
+If-None-Match with the ETag they last got for a URL; --gzip sends
+Accept-Encoding: gzip. Runs with and without them show what HTTP caching
+saves end to end.
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, urlencode
+
+import numpy as np
+
+import app as webapp
+from Backend import CACHE_TTL, set_repository
+from catalog import Catalog, set_catalog
+from storage import CachedRepository, LogRepository, MemoryRepository, SqliteRepository
+from synthetic import synthetic_users, write_catalog
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+
+HOST = '127.0.0.1'
+
+# Route -> relative weight in the traffic mix
+MIX = {
+    'home[anonymous,owners]': 20,
+    'home[anonymous,rating]': 10,
+    'home[user,ratings]': 15,
+    'home[user,selections]': 10,
+    'item': 25,
+    'search': 15,
+    'submit_review': 5,
+}
+
+DEFAULT_CONCURRENCY = (1, 8, 32)
+
+# Every this many synthetic users has no ratings, only the five selected games
+SELECTIONS_ONLY_EVERY = 4
+
+# Logged-in clients act as one of this many users of each kind
+LOGGED_IN_USERS = 50
+
+# Games whose item pages are requested, drawn by owners so popular pages are hot
+ITEM_PAGES = 1000
+
+STORAGES = ('sqlite', 'log', 'memory')
+
+REQUEST_TIMEOUT = 30
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log(self, type, message, *args):
+        # The access log of every request would swamp the report; errors still show
+        if type == 'error':
+            super().log(type, message, *args)
+
+
+def start_servers(app, workers):
+    # Forks `workers` processes serving app on one listening socket; returns (port, pids)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((HOST, 0))
+    listener.listen(512)
+    port = listener.getsockname()[1]
+
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server = make_server(HOST, port, app, threaded=True, request_handler=_QuietHandler,
+                                     fd=listener.fileno())
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    listener.close()
+    return port, pids
+
+
+def stop_servers(pids):
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+
+def make_repository(storage, df, n_users, seed, workdir):
+    """Repository holding the synthetic users, as the app would open it.
+
+    sqlite and log are seeded through migrate_from_json, like a first start
+    on the legacy files. memory is private to each worker process.
+    """
+    users, selections, ratings = synthetic_users(df, n_users, seed)
+    ratings = [r for r in ratings if int(r['username'][len('user'):]) % SELECTIONS_ONLY_EVERY]
+    if storage == 'memory':
+        return MemoryRepository(users, selections, ratings)
+
+    paths = []
+    for name, data in (('users', users), ('selections', selections), ('ratings', ratings)):
+        path = os.path.join(workdir, name + '.json')
+        with open(path, 'w') as f:
+            json.dump(data, f)
+        paths.append(path)
+    if storage == 'log':
+        repository = LogRepository(os.path.join(workdir, 'user_data_log'))
+        repository.migrate_from_json(*paths)
+        return repository
+    backend = SqliteRepository(os.path.join(workdir, 'user_data.db'))
+    backend.migrate_from_json(*paths)
+    return CachedRepository(backend, ttl=CACHE_TTL)
+
+
+def log_in(port, username, password):
+    # Value of the session cookie the app sets for this user
+    conn = http.client.HTTPConnection(HOST, port, timeout=REQUEST_TIMEOUT)
+    try:
+        body = urlencode({'username': username, 'password': password})
+        conn.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        response.read()
+        if response.status != 302:
+            raise RuntimeError("logging in %s returned %d" % (username, response.status))
+        return response.getheader('Set-Cookie').split(';', 1)[0]
+    finally:
+        conn.close()
+
+
+class Traffic:
+    """Requests of the mix, as (route, method, path, body, cookie, expected statuses)."""
+
+    def __init__(self, df, rating_cookies, selection_cookies, mix=MIX, seed=0):
+        self.routes = [route for route, weight in mix.items() if weight > 0]
+        self.weights = [mix[route] for route in self.routes]
+        self.rating_cookies = rating_cookies
+        self.selection_cookies = selection_cookies
+
+        rng = np.random.default_rng(seed)
+        appids = df['AppID'].astype(str).to_numpy()
+        weights = df['Estimated owners'].to_numpy().astype('float64') + 1.0
+        picks = rng.choice(len(appids), size=min(ITEM_PAGES, len(appids)), replace=False, p=weights / weights.sum())
+        self.appids = [quote(appids[row], safe='') for row in picks]
+        # Whole words and prefixes of game names (the names sit under 'AppID')
+        words = [name.split()[0].lower() for name in rng.choice(appids, size=200) if name.split()]
+        self.queries = [quote(word if i % 2 else word[:3]) for i, word in enumerate(words)]
+
+    def next_request(self, rng):
+        route = rng.choices(self.routes, self.weights)[0]
+        if route == 'home[anonymous,owners]':
+            return route, 'GET', '/', None, None, (200, 304)
+        if route == 'home[anonymous,rating]':
+            return route, 'GET', '/?filter=rating', None, None, (200, 304)
+        if route == 'home[user,ratings]':
+            return route, 'GET', '/', None, rng.choice(self.rating_cookies), (200, 304)
+        if route == 'home[user,selections]':
+            return route, 'GET', '/', None, rng.choice(self.selection_cookies), (200, 304)
+        if route == 'item':
+            return route, 'GET', '/item/' + rng.choice(self.appids), None, None, (200, 304)
+        if route == 'search':
+            return route, 'GET', '/?q=' + rng.choice(self.queries), None, None, (200, 304)
+        if route == 'submit_review':
+            body = 'rating=%d' % rng.randint(1, 5)
+            return route, 'POST', '/submit_review/' + rng.choice(self.appids), body, rng.choice(self.rating_cookies), (302,)
+        raise ValueError("unknown route %r" % route)
+
+
+def _headers(method, path, cookie, etags, revalidate, gzip):
+    headers = {}
+    if cookie:
+        headers['Cookie'] = cookie
+    if gzip:
+        headers['Accept-Encoding'] = 'gzip'
+    if method == 'POST':
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    elif revalidate and (path, cookie) in etags:
+        headers['If-None-Match'] = etags[path, cookie]
+    return headers
+
+
+def _thread_client(port, traffic, index, seed, measure_from, deadline, revalidate, gzip, samples):
+    rng = random.Random(seed * 1000003 + index)
+    etags = {}
+    conn = None
+    while True:
+        start = time.perf_counter()
+        if start >= deadline:
+            break
+        route, method, path, body, cookie, expected = traffic.next_request(rng)
+        status = None
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection(HOST, port, timeout=REQUEST_TIMEOUT)
+            conn.request(method, path, body, _headers(method, path, cookie, etags, revalidate, gzip))
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+            etag = response.getheader('ETag')
+            if etag:
+                etags[path, cookie] = etag
+            if response.will_close:
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            if conn is not None:
+                conn.close()
+            conn = None
+        if start >= measure_from:
+            samples.append((route, (time.perf_counter() - start) * 1000.0, status, status in expected))
+    if conn is not None:
+        conn.close()
+
+
+def run_threads(port, traffic, concurrency, seed, warmup, duration, revalidate, gzip):
+    samples = []
+    measure_from = time.perf_counter() + warmup
+    deadline = measure_from + duration
+    workers = [
+        threading.Thread(target=_thread_client,
+                         args=(port, traffic, index, seed, measure_from, deadline, revalidate, gzip, samples))
+        for index in range(concurrency)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return samples
+
+
+async def _async_exchange(reader, writer, method, path, body, headers):
+    # One HTTP/1.1 request on an open connection; returns (status, headers, keep_alive)
+    data = body.encode('utf-8') if body else b''
+    lines = ['%s %s HTTP/1.1' % (method, path), 'Host: %s' % HOST]
+    lines += ['%s: %s' % item for item in headers.items()]
+    if method == 'POST':
+        lines.append('Content-Length: %d' % len(data))
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + data)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    version, status = status_line.split()[:2]
+    status = int(status)
+    response_headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        response_headers[name.strip().lower()] = value.strip()
+
+    keep_alive = version == b'HTTP/1.1' and response_headers.get('connection', '').lower() != 'close'
+    if status in (204, 304) or 100 <= status < 200:
+        pass
+    elif 'content-length' in response_headers:
+        await reader.readexactly(int(response_headers['content-length']))
+    elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+        keep_alive = False
+    return status, response_headers, keep_alive
+
+
+async def _async_client(port, traffic, index, seed, measure_from, deadline, revalidate, gzip, samples):
+    rng = random.Random(seed * 1000003 + index)
+    etags = {}
+    connection = None
+    while True:
+        start = time.perf_counter()
+        if start >= deadline:
+            break
+        route, method, path, body, cookie, expected = traffic.next_request(rng)
+        status = None
+        try:
+            if connection is None:
+                connection = await asyncio.wait_for(asyncio.open_connection(HOST, port), REQUEST_TIMEOUT)
+            status, response_headers, keep_alive = await asyncio.wait_for(
+                _async_exchange(*connection, method, path, body,
+                                _headers(method, path, cookie, etags, revalidate, gzip)),
+                REQUEST_TIMEOUT,
+            )
+            if 'etag' in response_headers:
+                etags[path, cookie] = response_headers['etag']
+            if not keep_alive:
+                connection[1].close()
+                connection = None
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            if connection is not None:
+                connection[1].close()
+            connection = None
+        if start >= measure_from:
+            samples.append((route, (time.perf_counter() - start) * 1000.0, status, status in expected))
+    if connection is not None:
+        connection[1].close()
+
+
+def run_asyncio(port, traffic, concurrency, seed, warmup, duration, revalidate, gzip):
+    samples = []
+
+    async def main():
+        measure_from = time.perf_counter() + warmup
+        deadline = measure_from + duration
+        await asyncio.gather(*(
+            _async_client(port, traffic, index, seed, measure_from, deadline, revalidate, gzip, samples)
+            for index in range(concurrency)
+        ))
+    asyncio.run(main())
+    return samples
+
+
+MODELS = {'threads': run_threads, 'asyncio': run_asyncio}
+
+
+def summarize(samples, duration):
+    # Per-route stats of (route, ms, status, ok) samples, plus 'all'
+    by_route = {}
+    for sample in samples:
+        by_route.setdefault(sample[0], []).append(sample)
+    by_route['all'] = samples
+
+    results = {}
+    for route, route_samples in by_route.items():
+        if not route_samples:
+            continue
+        timings = np.array([ms for _, ms, _, _ in route_samples])
+        errors = sum(1 for _, _, _, ok in route_samples if not ok)
+        statuses = {}
+        for _, _, status, _ in route_samples:
+            key = str(status) if status is not None else 'failed'
+            statuses[key] = statuses.get(key, 0) + 1
+        p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+        results[route] = {
+            'requests': len(route_samples),
+            'requests_per_sec': round(len(route_samples) / duration, 1),
+            'error_rate': round(errors / len(route_samples), 4),
+            'statuses': statuses,
+            'mean_ms': round(float(timings.mean()), 4),
+            'p50_ms': round(float(p50), 4),
+            'p95_ms': round(float(p95), 4),
+            'p99_ms': round(float(p99), 4),
+            'max_ms': round(float(timings.max()), 4),
+        }
+    return results
+
+
+def run(n_rows=10000, n_users=500, concurrency=DEFAULT_CONCURRENCY, model='threads', workers=1,
+        storage='sqlite', duration=10.0, warmup=2.0, mix=MIX, revalidate=False, gzip=False, seed=0, log=print):
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'rows': n_rows,
+            'users': n_users,
+            'model': model,
+            'workers': workers,
+            'storage': storage,
+            'duration': duration,
+            'warmup': warmup,
+            'mix': mix,
+            'revalidate': revalidate,
+            'gzip': gzip,
+            'seed': seed,
+        },
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='steam-load-') as workdir:
+        path = write_catalog(os.path.join(workdir, 'items.csv'), n_rows, seed)
+        catalog = Catalog(path, os.path.join(workdir, 'genre-model.npz'), os.path.join(workdir, 'catalog-cache'))
+        catalog = catalog.refresh()
+        # Built before forking, so every worker starts with it
+        catalog.build_similar_items()
+        repository = make_repository(storage, catalog.df, n_users, seed, workdir)
+        set_catalog(catalog)
+        set_repository(repository)
+        # Only the synthetic users' precomputed blocks would be of any use
+        webapp.RECOMMENDATIONS_DB = os.path.join(workdir, 'recommendations.db')
+        webapp._recommendation_store = None
+
+        port, pids = start_servers(webapp.app, workers)
+        try:
+            users = repository.load_users()
+            rated = {r['username'] for r in repository.all_ratings()}
+            rating_users = sorted(name for name in users if name in rated)[:LOGGED_IN_USERS]
+            selection_users = sorted(name for name in users if name not in rated)[:LOGGED_IN_USERS]
+            if not rating_users or not selection_users:
+                raise ValueError("too few synthetic users for both kinds of logged-in traffic; raise --users")
+            traffic = Traffic(
+                catalog.df,
+                [log_in(port, name, users[name]) for name in rating_users],
+                [log_in(port, name, users[name]) for name in selection_users],
+                mix, seed,
+            )
+
+            log("%d rows, %d users, %d worker(s), %s clients, %s storage"
+                % (n_rows, n_users, workers, model, storage))
+            for level in concurrency:
+                samples = MODELS[model](port, traffic, level, seed, warmup, duration, revalidate, gzip)
+                results = report['results'][str(level)] = summarize(samples, duration)
+                log("concurrency %d" % level)
+                for route, stats in sorted(results.items(), key=lambda item: (item[0] == 'all', item[0])):
+                    log("  %-26s %8.1f req/s  p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms  errors %6.2f%%  304s %d"
+                        % (route, stats['requests_per_sec'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                           stats['error_rate'] * 100, stats['statuses'].get('304', 0)))
+        finally:
+            stop_servers(pids)
+            if hasattr(repository, 'close'):
+                repository.close()
+    return report
+
+
+def parse_mix(text):
+    # 'item=5,search=1' -> MIX with those weights; routes not named keep theirs
+    mix = dict(MIX)
+    for part in text.split(','):
+        route, _, weight = part.partition('=')
+        if route.strip() not in MIX:
+            raise argparse.ArgumentTypeError("unknown route %r; routes: %s" % (route.strip(), ', '.join(MIX)))
+        mix[route.strip()] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000, help="synthetic catalog rows")
+    parser.add_argument('--users', type=int, default=500, help="synthetic users")
+    parser.add_argument('--concurrency', nargs='+', type=int, default=list(DEFAULT_CONCURRENCY),
+                        help="concurrent clients, one run per value")
+    parser.add_argument('--model', choices=sorted(MODELS), default='threads', help="how clients run")
+    parser.add_argument('--workers', type=int, default=1, help="server processes")
+    parser.add_argument('--storage', choices=STORAGES, default='sqlite', help="user data backend")
+    parser.add_argument('--duration', type=float, default=10.0, help="measured seconds per concurrency level")
+    parser.add_argument('--warmup', type=float, default=2.0, help="unmeasured seconds before each level")
+    parser.add_argument('--mix', type=parse_mix, default=MIX, help="route weights, e.g. item=5,submit_review=0")
+    parser.add_argument('--revalidate', action='store_true', help="send If-None-Match like a browser cache")
+    parser.add_argument('--gzip', action='store_true', help="send Accept-Encoding: gzip")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON")
+    args = parser.parse_args(argv)
+    if args.storage == 'memory' and args.workers > 1:
+        parser.error("--storage memory is private to each process; use sqlite or log with --workers")
+
+    report = run(args.rows, args.users, args.concurrency, args.model, args.workers, args.storage,
+                 args.duration, args.warmup, args.mix, args.revalidate, args.gzip, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print("Wrote", args.output)
+    errors = sum(results['all']['error_rate'] > 0 for results in report['results'].values() if 'all' in results)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
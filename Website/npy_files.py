@@ -0,0 +1,47 @@
+"""Files that several processes write and read concurrently.
+
+Every file is written to a per-process temporary name and renamed into
+place, so a reader sees either the old file or the complete new one, and
+two writers never interleave. Sets of named arrays are stored as plain .npy
+files, so readers can memory-map them and share their pages.
+"""
+import os
+
+import numpy as np
+
+
+def write_atomic(path, write, mode='wb'):
+    # Calls write(f) on a temporary file, then renames it to `path`
+    tmp_path = '%s.tmp-%d' % (path, os.getpid())
+    try:
+        with open(tmp_path, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def array_path(stem, name):
+    return '%s.%s.npy' % (stem, name)
+
+
+def save_arrays(stem, arrays):
+    """Writes (name, array) pairs to <stem>.<name>.npy, in the given order.
+
+    load_arrays() only looks for the last one, so a reader that finds it
+    also finds the others.
+    """
+    for name, values in arrays:
+        write_atomic(array_path(stem, name), lambda f: np.save(f, values))
+
+
+def load_arrays(stem, names, mmap_mode='r'):
+    # {name: array} as saved by save_arrays() with the same names, or None
+    # when nothing was saved under `stem`
+    if not os.path.isfile(array_path(stem, names[-1])):
+        return None
+    return {name: np.load(array_path(stem, name), mmap_mode=mmap_mode) for name in names}
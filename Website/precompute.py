@@ -0,0 +1,171 @@
+"""Offline job that precomputes the personalized home-page blocks of every user.
+
+Run it from the repository root, e.g.
+
+    python Website/precompute.py --workers 4 --engines genre cf
+
+The results go to recommendations.db, which home() consults before
+computing blocks in the request. An entry is only used while the catalog
+file and the user's own ratings and selections are unchanged.
+
+It also builds the catalog's similar-games and search indexes if they are
+missing, next to the columnar cache. Item pages show no similar games until
+they exist, and the first search after a catalog update need not build its
+index.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from Backend import BASE_DIR, get_personalized_user_blocks, get_repository
+from catalog import get_catalog
+from collaborative import ItemItemRecommender
+from genre_index import SORT_COLUMNS
+from storage import ConnectionPool
+
+
+RECOMMENDATIONS_DB = os.path.join(BASE_DIR, "recommendations.db")
+
+FILTERS = tuple(SORT_COLUMNS)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recommendations (
+    username TEXT NOT NULL,
+    filter TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    catalog TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    blocks TEXT NOT NULL,
+    PRIMARY KEY (username, filter, engine)
+);
+"""
+
+
+def user_fingerprint(user_selected_appids, user_ratings):
+    # Changes whenever the user's selections or ratings change
+    payload = json.dumps([
+        [str(appid) for appid in user_selected_appids],
+        sorted([str(r['appid']), r['rating']] for r in user_ratings),
+    ])
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def encode_blocks(genre_blocks):
+    # Blocks are stored as catalog row positions, not records
+    return json.dumps(
+        [[genre, [int(row) for row in rows]] for genre, rows in genre_blocks.items()],
+        separators=(',', ':'),
+    )
+
+
+def decode_blocks(payload):
+    return {genre: np.array(rows, dtype='int64') for genre, rows in json.loads(payload)}
+
+
+class RecommendationStore:
+    """Precomputed blocks keyed by (username, filter, engine)."""
+
+    def __init__(self, path=RECOMMENDATIONS_DB):
+        self.path = path
+        self.pool = ConnectionPool(path)
+        with self.pool.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def get(self, username, filter_option, engine, catalog_fingerprint, inputs):
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT catalog, inputs, blocks FROM recommendations WHERE username = ? AND filter = ? AND engine = ?",
+                (username, filter_option, engine),
+            ).fetchone()
+        if row is None or row['catalog'] != catalog_fingerprint or row['inputs'] != inputs:
+            return None
+        return row['blocks']
+
+    def put_many(self, entries):
+        # entries: (username, filter, engine, catalog, inputs, blocks) tuples
+        with self.pool.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO recommendations (username, filter, engine, catalog, inputs, blocks) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                entries,
+            )
+
+
+_worker = {}
+
+
+def _init_worker(recommender):
+    catalog = get_catalog()
+    _worker['catalog'] = catalog
+    _worker['recommender'] = recommender
+
+
+def _compute_chunk(users, engines):
+    catalog = _worker['catalog']
+    entries = []
+    for username, user_selected_appids, user_ratings in users:
+        inputs = user_fingerprint(user_selected_appids, user_ratings)
+        for engine in engines:
+            recommender = _worker['recommender'] if engine == 'cf' else None
+            for filter_option in FILTERS:
+                genre_blocks = get_personalized_user_blocks(
+                    catalog.df, user_selected_appids, user_ratings, sort_by=filter_option,
+                    genre_index=catalog.genre_index, genre_model=catalog.genre_model, recommender=recommender,
+                    item_index=catalog.item_index,
+                )
+                entries.append((
+                    username, filter_option, engine, catalog.fingerprint, inputs,
+                    encode_blocks(genre_blocks),
+                ))
+    return entries
+
+
+def precompute(workers=None, engines=('genre',), chunk_size=64, path=RECOMMENDATIONS_DB):
+    repository = get_repository()
+    catalog = get_catalog()
+    catalog.build_similar_items()
+    catalog.search_index()
+    selections = repository.all_selections()
+    ratings = {}
+    for r in repository.all_ratings():
+        ratings.setdefault(r['username'], []).append(r)
+
+    usernames = sorted(set(selections) | set(ratings))
+    users = [(username, selections.get(username, []), ratings.get(username, [])) for username in usernames]
+    chunks = [users[i:i + chunk_size] for i in range(0, len(users), chunk_size)]
+
+    recommender = None
+    if 'cf' in engines:
+        recommender = ItemItemRecommender.fit(
+            catalog.df, repository.all_ratings(), item_positions=catalog.item_index.positions
+        )
+
+    store = RecommendationStore(path)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(recommender,)) as pool:
+        for entries in pool.map(_compute_chunk, chunks, [tuple(engines)] * len(chunks)):
+            store.put_many(entries)
+    elapsed = time.perf_counter() - start
+    return len(users), elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--engines', nargs='+', default=['genre'], choices=['genre', 'cf'])
+    parser.add_argument('--chunk-size', type=int, default=64, help="users per task")
+    parser.add_argument('--output', default=RECOMMENDATIONS_DB)
+    args = parser.parse_args(argv)
+
+    n_users, elapsed = precompute(args.workers, args.engines, args.chunk_size, args.output)
+    rate = n_users / elapsed if elapsed > 0 else float('inf')
+    print("Precomputed %d users in %.2fs (%.1f users/sec) -> %s" % (n_users, elapsed, rate, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import numpy as np
+
+
+# Registry of catalog-wide scores: column name -> function(positive, negative) -> array
+SCORERS = {}
+
+
+def register_scorer(name):
+    def decorator(func):
+        SCORERS[name] = func
+        return func
+    return decorator
+
+
+def _counts(positive, negative):
+    positive = np.asarray(positive, dtype='float64')
+    negative = np.asarray(negative, dtype='float64')
+    return positive, positive + negative
+
+
+def rating_percent(positive, negative, decimals=0):
+    # Same rule as the old per-row lambda: round(100 * P / (P + N)), 0 when unrated
+    positive, total = _counts(positive, negative)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent = np.where(total > 0, np.round(100 * positive / total, decimals), 0)
+    if decimals == 0:
+        return percent.astype('int64')
+    return percent
+
+
+@register_scorer('RatingPercent')
+def _rating_percent_scorer(positive, negative):
+    return rating_percent(positive, negative)
+
+
+@register_scorer('WilsonScore')
+def wilson_lower_bound(positive, negative, z=1.96):
+    # Lower bound of the Wilson score interval for the share of positive reviews
+    positive, total = _counts(positive, negative)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        phat = positive / total
+        z2 = z * z
+        bound = (phat + z2 / (2 * total) - z * np.sqrt((phat * (1 - phat) + z2 / (4 * total)) / total)) / (1 + z2 / total)
+    return np.where(total > 0, 100 * bound, 0.0)
+
+
+@register_scorer('BayesianRating')
+def bayesian_average(positive, negative, prior_mean=None, prior_weight=None):
+    # Pulls games with few reviews towards the catalog-wide positive share
+    positive, total = _counts(positive, negative)
+    if prior_mean is None:
+        prior_mean = positive.sum() / total.sum() if total.sum() > 0 else 0.5
+    if prior_weight is None:
+        prior_weight = np.median(total) if len(total) else 0.0
+    denominator = prior_weight + total
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = (prior_weight * prior_mean + positive) / denominator
+    return np.where(denominator > 0, 100 * score, 0.0)
+
+
+def compute_scores(df, names=None):
+    # Adds every registered score (or just `names`) to df, reading the review counts once
+    positive = df['Positive'].to_numpy()
+    negative = df['Negative'].to_numpy()
+    for name in names or SCORERS:
+        df[name] = SCORERS[name](positive, negative)
+    return df
@@ -0,0 +1,281 @@
+import itertools
+import re
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+import pandas as pd
+
+from npy_files import load_arrays, save_arrays
+from topk import top_k
+
+
+# Field -> weight of a token match in that field. 'AppID' is the column that
+# actually holds the game name in items.csv.
+SEARCH_FIELDS = {
+    'AppID': 3.0,
+    'Developers': 2.0,
+    'Publishers': 1.5,
+    'Tags': 1.0,
+}
+
+# Score multipliers for the looser kinds of match
+PREFIX_FACTOR = 0.8
+FUZZY_FACTOR = 0.5
+# Bonus when the whole query is the start of the game name
+NAME_PREFIX_BONUS = 5.0
+# At most this many vocabulary tokens are expanded per prefix or typo
+MAX_EXPANSIONS = 50
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    if not isinstance(text, str):
+        return []
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _trigrams(token):
+    padded = '  ' + token + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _within_distance(a, b, max_distance):
+    # Levenshtein distance <= max_distance, with an early exit per row
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > max_distance:
+            return False
+        previous = current
+    return previous[-1] <= max_distance
+
+
+class SearchIndex:
+    """Token inverted index over game names, developers, publishers and tags.
+
+    Query terms match exactly, as a prefix of an indexed token, or, when
+    neither finds anything, within a small edit distance (candidates come from
+    a trigram index over the vocabulary). Every term must match for a game to
+    be returned; results are ranked by match score, then by `popularity`.
+
+    The postings are flat arrays: the rows and field weights of the i-th
+    vocabulary token (vocabulary sorted) are rows[indptr[i]:indptr[i + 1]],
+    so a prefix's expansions are one contiguous slice, and a query only
+    touches the postings it matches. build() makes an index from a frame;
+    save() and load() keep it next to the columnar cache.
+    """
+
+    def __init__(self, names, popularity, vocabulary, indptr, rows, weights, trigrams, trigram_indptr,
+                 trigram_tokens, name_order):
+        self.n_rows = len(names)
+        self.names = names
+        self._names_lower = [name.lower() for name in names]
+        self.popularity = np.asarray(popularity, dtype='float64')
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.rows = rows
+        self.weights = weights
+        self._token_lengths = np.fromiter(map(len, vocabulary), dtype='int64', count=len(vocabulary))
+        self._trigrams = {trigram: i for i, trigram in enumerate(trigrams)}
+        self.trigrams = trigrams
+        self.trigram_indptr = trigram_indptr
+        self.trigram_tokens = trigram_tokens
+        # Rows by lower-cased name, for the whole-query name prefix bonus
+        self.name_order = name_order
+
+    @classmethod
+    def build(cls, df, popularity=None, multi_valued=None):
+        """Index of df. multi_valued holds the pre-split columns from the
+        columnar cache (see ingest.load_columnar); a field found there is
+        tokenized once per distinct value instead of once per game."""
+        n_rows = len(df)
+        names = df['AppID'].astype(str).tolist()
+        if popularity is None:
+            popularity = df['Estimated owners'].to_numpy()
+
+        token_ids = {}
+        field_rows, field_tokens, field_weights = [], [], []
+        for column, weight in SEARCH_FIELDS.items():
+            if multi_valued and column in multi_valued:
+                values, codes, offsets = multi_valued[column]
+                value_rows = np.repeat(np.arange(n_rows), np.diff(offsets))
+                value_codes = np.asarray(codes, dtype='int64')
+            elif column in df:
+                codes, values = pd.factorize(df[column])
+                value_rows = np.flatnonzero(codes >= 0)
+                value_codes = codes[value_rows].astype('int64')
+            else:
+                continue
+            # Token ids of every distinct value, flattened, then one (row, token) pair per use
+            value_tokens = [[token_ids.setdefault(token, len(token_ids)) for token in tokenize(value)]
+                            for value in values]
+            counts = np.fromiter(map(len, value_tokens), dtype='int64', count=len(value_tokens))
+            flat = np.fromiter(itertools.chain.from_iterable(value_tokens), dtype='int64', count=int(counts.sum()))
+            starts = np.cumsum(counts) - counts
+            per_use = counts[value_codes]
+            total = int(per_use.sum())
+            first = np.repeat(starts[value_codes] - (np.cumsum(per_use) - per_use), per_use)
+            field_rows.append(np.repeat(value_rows, per_use))
+            field_tokens.append(flat[first + np.arange(total)])
+            field_weights.append(np.full(total, weight, dtype='float32'))
+
+        vocabulary = sorted(token_ids)
+        rank = np.empty(len(vocabulary), dtype='int64')
+        rank[[token_ids[token] for token in vocabulary]] = np.arange(len(vocabulary))
+        if field_rows:
+            rows = np.concatenate(field_rows)
+            tokens = rank[np.concatenate(field_tokens)]
+            weights = np.concatenate(field_weights)
+        else:
+            rows = tokens = np.zeros(0, dtype='int64')
+            weights = np.zeros(0, dtype='float32')
+        # Grouped by token, rows ascending; a game matching a token in several fields keeps the best weight
+        keys = tokens * max(n_rows, 1) + rows
+        order = np.lexsort((-weights, keys))
+        keys = keys[order]
+        keep = np.ones(len(keys), dtype=bool)
+        keep[1:] = keys[1:] != keys[:-1]
+        order = order[keep]
+        indptr = np.zeros(len(vocabulary) + 1, dtype='int64')
+        np.cumsum(np.bincount(tokens[order], minlength=len(vocabulary)), out=indptr[1:])
+
+        token_trigrams = [_trigrams(token) for token in vocabulary]
+        trigrams = sorted(set().union(*token_trigrams))
+        trigram_ids = {trigram: i for i, trigram in enumerate(trigrams)}
+        pairs = np.array([(trigram_ids[trigram], token) for token, token_set in enumerate(token_trigrams)
+                          for trigram in token_set], dtype='int64').reshape(-1, 2)
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        trigram_indptr = np.zeros(len(trigrams) + 1, dtype='int64')
+        np.cumsum(np.bincount(pairs[:, 0], minlength=len(trigrams)), out=trigram_indptr[1:])
+
+        names_lower = [name.lower() for name in names]
+        name_order = np.array(sorted(range(n_rows), key=names_lower.__getitem__), dtype='int32')
+        return cls(names, popularity, vocabulary, indptr, rows[order].astype('int32'), weights[order], trigrams,
+                   trigram_indptr, pairs[:, 1].astype('int32'), name_order)
+
+    def _prefix_range(self, prefix):
+        # Vocabulary positions [start, stop) of the tokens starting with prefix, at most MAX_EXPANSIONS
+        start = bisect_left(self.vocabulary, prefix)
+        stop = bisect_right(self.vocabulary, prefix, lo=start, hi=min(start + MAX_EXPANSIONS, len(self.vocabulary)),
+                            key=lambda token: token[:len(prefix)])
+        return start, stop
+
+    def _fuzzy_tokens(self, term):
+        if len(term) < 4:
+            return []
+        max_distance = 1 if len(term) < 8 else 2
+        trigrams = [self._trigrams[trigram] for trigram in _trigrams(term) if trigram in self._trigrams]
+        if not trigrams:
+            return []
+        candidates = np.concatenate([self.trigram_tokens[self.trigram_indptr[i]:self.trigram_indptr[i + 1]]
+                                     for i in trigrams])
+        tokens, shared = np.unique(candidates, return_counts=True)
+        # Each edit destroys at most three trigrams, so weaker overlaps cannot match
+        min_shared = len(_trigrams(term)) - 3 * max_distance
+        keep = (shared >= min_shared) & (np.abs(self._token_lengths[tokens] - len(term)) <= max_distance)
+        tokens, shared = tokens[keep], shared[keep]
+        tokens = tokens[np.argsort(-shared, kind='stable')]
+        matches = [int(token) for token in tokens if _within_distance(term, self.vocabulary[token], max_distance)]
+        return matches[:MAX_EXPANSIONS]
+
+    def _term_scores(self, term):
+        # (rows, scores) of the games matching term, rows ascending; a game
+        # matched through several tokens keeps its best score
+        start, stop = self._prefix_range(term)
+        if start < stop:
+            exact = start if self.vocabulary[start] == term else None
+            spans = [(start, stop, PREFIX_FACTOR)]
+            if exact is not None:
+                spans = [(start, start + 1, 1.0), (start + 1, stop, PREFIX_FACTOR)]
+        else:
+            spans = [(token, token + 1, FUZZY_FACTOR) for token in self._fuzzy_tokens(term)]
+        rows, scores = [], []
+        for first, last, factor in spans:
+            begin, end = self.indptr[first], self.indptr[last]
+            rows.append(self.rows[begin:end])
+            scores.append(self.weights[begin:end].astype('float64') * factor)
+        if not rows:
+            return np.zeros(0, dtype='int64'), np.zeros(0)
+        rows = np.concatenate(rows).astype('int64')
+        scores = np.concatenate(scores)
+        if len(spans) == 1 and spans[0][1] - spans[0][0] == 1:
+            # One token's postings: rows are already unique and ascending
+            return rows, scores
+        order = np.argsort(rows, kind='stable')
+        rows, scores = rows[order], scores[order]
+        starts = np.flatnonzero(np.concatenate(([True], rows[1:] != rows[:-1])))
+        return rows[starts], np.maximum.reduceat(scores, starts)
+
+    def search(self, query, limit=None, popularity=None):
+        # Row positions of the matching games, best first; at most `limit` of them
+        terms = tokenize(query)
+        if not terms or (limit is not None and limit <= 0):
+            return np.empty(0, dtype='int64')
+
+        candidates = scores = None
+        for term in terms:
+            rows, term_scores = self._term_scores(term)
+            if candidates is None:
+                candidates, scores = rows, term_scores
+            else:
+                candidates, mine, theirs = np.intersect1d(candidates, rows, assume_unique=True, return_indices=True)
+                scores = scores[mine] + term_scores[theirs]
+            if len(candidates) == 0:
+                return candidates
+
+        phrase = query.strip().lower()
+        key = lambda row: self._names_lower[row][:len(phrase)]
+        start = bisect_left(self.name_order, phrase, key=key)
+        stop = bisect_right(self.name_order, phrase, lo=start, key=key)
+        bonus = np.isin(candidates, self.name_order[start:stop])
+        scores = scores + NAME_PREFIX_BONUS * bonus
+
+        popularity = self.popularity if popularity is None else np.asarray(popularity)
+        if limit is not None and limit < len(candidates):
+            # Only the best `limit` games get sorted: every game scoring above
+            # the limit-th score, then the most popular of those tied with it
+            threshold = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+            above = np.flatnonzero(scores > threshold)
+            tied = np.flatnonzero(scores == threshold)
+            tied = tied[top_k(popularity[candidates[tied]], limit - len(above))]
+            selected = np.sort(np.concatenate([above, tied]))
+            candidates, scores = candidates[selected], scores[selected]
+        order = np.lexsort((-popularity[candidates], -scores))
+        rows = candidates[order]
+        return rows if limit is None else rows[:limit]
+
+    def complete(self, prefix, limit=10):
+        # Game names for an autocomplete box
+        return [self.names[row] for row in self.search(prefix, limit=limit)]
+
+    # Arrays saved by save(), in writing order
+    ARRAYS = ('vocabulary', 'rows', 'weights', 'trigrams', 'trigram_indptr', 'trigram_tokens', 'name_order', 'indptr')
+
+    def save(self, stem):
+        # The string lists are stored as newline-joined UTF-8 (tokens and
+        # trigrams never contain a newline)
+        arrays = []
+        for name in self.ARRAYS:
+            values = getattr(self, name)
+            if name in ('vocabulary', 'trigrams'):
+                values = np.frombuffer('\n'.join(values).encode('utf-8'), dtype='uint8')
+            arrays.append((name, values))
+        save_arrays(stem, arrays)
+
+    @classmethod
+    def load(cls, stem, df, popularity=None, mmap_mode='r'):
+        # None unless an index of df's rows was saved under `stem`
+        arrays = load_arrays(stem, cls.ARRAYS, mmap_mode)
+        if arrays is None or len(arrays['name_order']) != len(df):
+            return None
+        for name in ('vocabulary', 'trigrams'):
+            text = arrays[name].tobytes().decode('utf-8')
+            arrays[name] = text.split('\n') if text else []
+        if popularity is None:
+            popularity = df['Estimated owners'].to_numpy()
+        return cls(df['AppID'].astype(str).tolist(), popularity, **arrays)
@@ -0,0 +1,130 @@
+import numpy as np
+from scipy import sparse
+
+from ingest import split_multi_valued
+from instrumentation import timed
+from npy_files import load_arrays, save_arrays
+
+
+# Columns whose values describe a game's content; each becomes a block of
+# multi-hot features
+SIMILARITY_COLUMNS = ('Tags', 'Categories', 'Genres', 'Developers')
+
+# Similarity entries computed per block: rows per block * catalog rows. Bounds
+# the dense block of scores held in memory (4 bytes each).
+BLOCK_ENTRIES = 1 << 24
+
+# Features carried by at least this share of the games are multiplied as a
+# dense matrix; the long tail (most developers, rare tags) stays sparse
+DENSE_MIN_SHARE = 0.01
+
+
+def feature_matrix(df, multi_valued=None):
+    """Sparse TF-IDF matrix of the SIMILARITY_COLUMNS values, one row per game.
+
+    Every value of a column (a tag, a developer, ...) is one binary feature,
+    weighted by its smoothed inverse document frequency, so shared rare tags
+    count for more than sharing 'Indie'. Rows are L2-normalised, so a dot
+    product of two rows is their cosine similarity. multi_valued holds the
+    pre-split columns from the columnar cache (see ingest.load_columnar).
+    """
+    n_rows = len(df)
+    blocks = []
+    for column in SIMILARITY_COLUMNS:
+        if multi_valued and column in multi_valued:
+            vocabulary, codes, offsets = multi_valued[column]
+        elif column in df:
+            vocabulary, codes, offsets = split_multi_valued(df[column])
+        else:
+            continue
+        codes = np.asarray(codes)
+        rows = np.repeat(np.arange(n_rows), np.diff(offsets))
+        block = sparse.csr_matrix(
+            (np.ones(len(codes), dtype='float32'), (rows, codes)), shape=(n_rows, len(vocabulary))
+        )
+        # A value listed twice for one game is still one feature
+        block.sum_duplicates()
+        block.data[:] = 1.0
+        frequency = np.bincount(codes, minlength=len(vocabulary))
+        idf = np.log((1.0 + n_rows) / (1.0 + frequency)) + 1.0
+        blocks.append(block @ sparse.diags(idf.astype('float32')))
+
+    if not blocks:
+        return sparse.csr_matrix((n_rows, 0), dtype='float32')
+    matrix = sparse.hstack(blocks, format='csr', dtype='float32')
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return (sparse.diags((1.0 / norms).astype('float32')) @ matrix).tocsr()
+
+
+class SimilarItems:
+    """Top-N content neighbours of every game, precomputed once per catalog version.
+
+    `neighbours` holds catalog row positions (int32) and `scores` their
+    cosine similarity (float16), one row per game, best first and padded
+    with -1 / 0. Looking up a game's similar games is a row slice.
+    """
+
+    def __init__(self, neighbours, scores):
+        self.neighbours = neighbours
+        self.scores = scores
+
+    @classmethod
+    @timed('similar_fit')
+    def fit(cls, df, multi_valued=None, n_neighbours=20, block_entries=BLOCK_ENTRIES):
+        matrix = feature_matrix(df, multi_valued)
+        n_rows = matrix.shape[0]
+        k = max(0, min(n_neighbours, n_rows - 1))
+        neighbours = np.full((n_rows, n_neighbours), -1, dtype='int32')
+        scores = np.zeros((n_rows, n_neighbours), dtype='float16')
+        if k == 0:
+            return cls(neighbours, scores)
+
+        # Scores are computed a block of rows at a time, so the N x N
+        # similarity matrix is never built. Frequent features (shared by many
+        # games, so their products are mostly non-zero) go through a dense
+        # matrix product; the rare ones through a sparse product whose few
+        # entries are added to the block.
+        frequent = np.diff(matrix.tocsc().indptr) >= DENSE_MIN_SHARE * n_rows
+        dense = np.ascontiguousarray(matrix[:, np.flatnonzero(frequent)].toarray())
+        rare = matrix[:, np.flatnonzero(~frequent)].tocsr()
+        rare_t = rare.T.tocsr()
+
+        block_size = max(1, block_entries // n_rows)
+        for start in range(0, n_rows, block_size):
+            stop = min(start + block_size, n_rows)
+            block = dense[start:stop] @ dense.T
+            if rare.shape[1]:
+                extra = (rare[start:stop] @ rare_t).tocoo()
+                block[extra.row, extra.col] += extra.data
+            block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+
+            top = np.argpartition(block, n_rows - k, axis=1)[:, n_rows - k:]
+            top_scores = np.take_along_axis(block, top, axis=1)
+            # Best first, ties in row order
+            order = np.lexsort((top, -top_scores), axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+            neighbours[start:stop, :k] = top
+            scores[start:stop, :k] = top_scores
+        return cls(neighbours, scores)
+
+    def similar(self, row, n=None):
+        # Row positions of the games most similar to `row`; only those sharing something with it
+        neighbours = self.neighbours[row]
+        keep = (neighbours >= 0) & (self.scores[row] > 0)
+        return neighbours[keep][:n].astype('int64')
+
+    ARRAYS = ('scores', 'neighbours')
+
+    def save(self, stem):
+        save_arrays(stem, [(name, getattr(self, name)) for name in self.ARRAYS])
+
+    @classmethod
+    def load(cls, stem, n_rows=None, mmap_mode='r'):
+        # None unless an index for n_rows games was saved under `stem`
+        arrays = load_arrays(stem, cls.ARRAYS, mmap_mode)
+        if arrays is None or (n_rows is not None and len(arrays['neighbours']) != n_rows):
+            return None
+        return cls(**arrays)
@@ -0,0 +1,948 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS selections (
+    username TEXT PRIMARY KEY,
+    appids TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ratings (
+    username TEXT NOT NULL,
+    appid TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    PRIMARY KEY (username, appid)
+);
+CREATE TABLE IF NOT EXISTS genre_profiles (
+    username TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    weights TEXT NOT NULL,
+    PRIMARY KEY (username, kind)
+);
+CREATE TABLE IF NOT EXISTS migrations (
+    name TEXT PRIMARY KEY
+);
+"""
+
+
+class Repository:
+    """Storage interface for users, their setup selections and their ratings.
+
+    Ratings are dicts of the form {'username': ..., 'appid': ..., 'rating': ...}.
+    Genre profiles are {genre: weight} dicts derived from a user's ratings or
+    selections, stored per (username, kind) so they can be updated in place.
+    """
+
+    def load_users(self):
+        raise NotImplementedError
+
+    def create_user(self, username, password):
+        # Adds a new user; False (and no change) when the username is taken
+        raise NotImplementedError
+
+    def selection_for(self, username):
+        raise NotImplementedError
+
+    def all_selections(self):
+        raise NotImplementedError
+
+    def save_selection(self, username, appids):
+        raise NotImplementedError
+
+    def ratings_for(self, username):
+        raise NotImplementedError
+
+    def all_ratings(self):
+        raise NotImplementedError
+
+    def upsert_rating(self, username, appid, rating):
+        # Returns the rating it replaced, or None
+        raise NotImplementedError
+
+    def upsert_rating_with_profile(self, username, appid, rating, kind, previous, deltas):
+        # upsert_rating() plus, atomically, the matching change to a stored
+        # profile: deltas are for a change from `previous`, so if the rating
+        # replaced was another one the profile is dropped instead (to be
+        # rebuilt on the next read). Returns the rating it replaced, or None
+        raise NotImplementedError
+
+    def genre_profile(self, username, kind):
+        # None when no profile is stored
+        raise NotImplementedError
+
+    def save_genre_profile(self, username, kind, weights):
+        raise NotImplementedError
+
+    def delete_genre_profile(self, username, kind):
+        raise NotImplementedError
+
+    def ensure_genre_profile(self, username, kind, build):
+        # The stored profile, or else build(selection, ratings) of the user's
+        # current data, stored unless a profile appeared meanwhile. Reading the
+        # data and storing the result is atomic, so no write in between is lost.
+        raise NotImplementedError
+
+
+def _profile_inputs(selection, ratings):
+    # The data a genre profile is built from, in a JSON-comparable form
+    return [list(selection), [[r['appid'], r['rating']] for r in ratings]]
+
+
+def merge_genre_weights(weights, deltas):
+    merged = dict(weights)
+    for genre, delta in deltas.items():
+        merged[genre] = merged.get(genre, 0.0) + delta
+        # Ratings that were added and removed again should not leave float dust behind
+        if abs(merged[genre]) < 1e-9:
+            del merged[genre]
+    return merged
+
+
+class MemoryRepository(Repository):
+    """Process-local repository, for tests and throwaway instances."""
+
+    def __init__(self, users=None, selections=None, ratings=None):
+        self._lock = threading.Lock()
+        self._users = dict(users or {})
+        self._selections = {username: list(appids) for username, appids in (selections or {}).items()}
+        self._ratings = {}
+        self._profiles = {}
+        for r in ratings or []:
+            self.upsert_rating(r['username'], r['appid'], r['rating'])
+
+    def load_users(self):
+        with self._lock:
+            return dict(self._users)
+
+    def create_user(self, username, password):
+        with self._lock:
+            if username in self._users:
+                return False
+            self._users[username] = password
+            return True
+
+    def selection_for(self, username):
+        with self._lock:
+            return list(self._selections.get(username, []))
+
+    def all_selections(self):
+        with self._lock:
+            return {username: list(appids) for username, appids in self._selections.items()}
+
+    def save_selection(self, username, appids):
+        with self._lock:
+            self._selections[username] = list(appids)
+
+    def ratings_for(self, username):
+        with self._lock:
+            return [dict(r) for r in self._ratings.get(username, {}).values()]
+
+    def all_ratings(self):
+        with self._lock:
+            return [dict(r) for user_ratings in self._ratings.values() for r in user_ratings.values()]
+
+    def upsert_rating(self, username, appid, rating):
+        with self._lock:
+            return self._upsert_rating(username, appid, rating)
+
+    def _upsert_rating(self, username, appid, rating):
+        user_ratings = self._ratings.setdefault(username, {})
+        if appid in user_ratings:
+            previous = user_ratings[appid]['rating']
+            user_ratings[appid]['rating'] = rating
+            return previous
+        user_ratings[appid] = {"username": username, "appid": appid, "rating": rating}
+        return None
+
+    def upsert_rating_with_profile(self, username, appid, rating, kind, previous, deltas):
+        with self._lock:
+            replaced = self._upsert_rating(username, appid, rating)
+            weights = self._profiles.get((username, kind))
+            if weights is not None:
+                if replaced == previous:
+                    self._profiles[(username, kind)] = merge_genre_weights(weights, deltas)
+                else:
+                    del self._profiles[(username, kind)]
+            return replaced
+
+    def genre_profile(self, username, kind):
+        with self._lock:
+            weights = self._profiles.get((username, kind))
+            return dict(weights) if weights is not None else None
+
+    def save_genre_profile(self, username, kind, weights):
+        with self._lock:
+            self._profiles[(username, kind)] = dict(weights)
+
+    def delete_genre_profile(self, username, kind):
+        with self._lock:
+            self._profiles.pop((username, kind), None)
+
+    def ensure_genre_profile(self, username, kind, build):
+        with self._lock:
+            weights = self._profiles.get((username, kind))
+            if weights is None:
+                selection = list(self._selections.get(username, []))
+                ratings = [dict(r) for r in self._ratings.get(username, {}).values()]
+                weights = self._profiles[(username, kind)] = dict(build(selection, ratings))
+            return dict(weights)
+
+
+class ConnectionPool:
+    """Small pool of SQLite connections in WAL mode, shared by the threads of one process."""
+
+    def __init__(self, path, size=5):
+        self.path = path
+        self.size = size
+        self._pid = None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _queue(self):
+        # Connections must not cross a fork, so each worker process gets its own pool
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._pool = queue.LifoQueue(maxsize=self.size)
+                    self._pid = pid
+        return self._pool
+
+    @contextmanager
+    def connection(self):
+        pool = self._queue()
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            try:
+                pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+
+class SqliteRepository(Repository):
+    """Durable repository in an embedded SQLite database.
+
+    Ratings are keyed by (username, appid); that primary key doubles as the
+    per-user index.
+    """
+
+    def __init__(self, path, pool_size=5):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.pool = ConnectionPool(path, pool_size)
+        with self.pool.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def load_users(self):
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT username, password FROM users ORDER BY rowid").fetchall()
+        return {row['username']: row['password'] for row in rows}
+
+    def create_user(self, username, password):
+        try:
+            with self.pool.connection() as conn:
+                conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def selection_for(self, username):
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT appids FROM selections WHERE username = ?", (username,)).fetchone()
+        return json.loads(row['appids']) if row else []
+
+    def all_selections(self):
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT username, appids FROM selections ORDER BY rowid").fetchall()
+        return {row['username']: json.loads(row['appids']) for row in rows}
+
+    def save_selection(self, username, appids):
+        with self.pool.connection() as conn:
+            conn.execute(
+                "INSERT INTO selections (username, appids) VALUES (?, ?) "
+                "ON CONFLICT (username) DO UPDATE SET appids = excluded.appids",
+                (username, json.dumps(list(appids))),
+            )
+
+    def ratings_for(self, username):
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT username, appid, rating FROM ratings WHERE username = ? ORDER BY rowid",
+                (username,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def all_ratings(self):
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT username, appid, rating FROM ratings ORDER BY rowid").fetchall()
+        return [dict(row) for row in rows]
+
+    def upsert_rating(self, username, appid, rating):
+        with self.pool.transaction() as conn:
+            row = conn.execute(
+                "SELECT rating FROM ratings WHERE username = ? AND appid = ?", (username, appid)
+            ).fetchone()
+            conn.execute(
+                "INSERT INTO ratings (username, appid, rating) VALUES (?, ?, ?) "
+                "ON CONFLICT (username, appid) DO UPDATE SET rating = excluded.rating",
+                (username, appid, rating),
+            )
+        return row['rating'] if row else None
+
+    def upsert_rating_with_profile(self, username, appid, rating, kind, previous, deltas):
+        # One transaction, so a profile rebuilt concurrently either misses
+        # both the rating and the deltas or already has the rating and no deltas
+        with self.pool.transaction() as conn:
+            row = conn.execute(
+                "SELECT rating FROM ratings WHERE username = ? AND appid = ?", (username, appid)
+            ).fetchone()
+            replaced = row['rating'] if row else None
+            conn.execute(
+                "INSERT INTO ratings (username, appid, rating) VALUES (?, ?, ?) "
+                "ON CONFLICT (username, appid) DO UPDATE SET rating = excluded.rating",
+                (username, appid, rating),
+            )
+            row = conn.execute(
+                "SELECT weights FROM genre_profiles WHERE username = ? AND kind = ?", (username, kind)
+            ).fetchone()
+            if row is not None and replaced == previous:
+                conn.execute(
+                    "UPDATE genre_profiles SET weights = ? WHERE username = ? AND kind = ?",
+                    (json.dumps(merge_genre_weights(json.loads(row['weights']), deltas)), username, kind),
+                )
+            elif row is not None:
+                conn.execute("DELETE FROM genre_profiles WHERE username = ? AND kind = ?", (username, kind))
+        return replaced
+
+    def genre_profile(self, username, kind):
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT weights FROM genre_profiles WHERE username = ? AND kind = ?", (username, kind)
+            ).fetchone()
+        return json.loads(row['weights']) if row else None
+
+    def save_genre_profile(self, username, kind, weights):
+        with self.pool.connection() as conn:
+            conn.execute(
+                "INSERT INTO genre_profiles (username, kind, weights) VALUES (?, ?, ?) "
+                "ON CONFLICT (username, kind) DO UPDATE SET weights = excluded.weights",
+                (username, kind, json.dumps(weights)),
+            )
+
+    def delete_genre_profile(self, username, kind):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM genre_profiles WHERE username = ? AND kind = ?", (username, kind))
+
+    def ensure_genre_profile(self, username, kind, build):
+        # Under the write lock, so no rating or selection can land between the read and the insert
+        with self.pool.transaction() as conn:
+            row = conn.execute(
+                "SELECT weights FROM genre_profiles WHERE username = ? AND kind = ?", (username, kind)
+            ).fetchone()
+            if row is not None:
+                return json.loads(row['weights'])
+            row = conn.execute("SELECT appids FROM selections WHERE username = ?", (username,)).fetchone()
+            selection = json.loads(row['appids']) if row else []
+            ratings = [dict(r) for r in conn.execute(
+                "SELECT username, appid, rating FROM ratings WHERE username = ? ORDER BY rowid", (username,)
+            ).fetchall()]
+            weights = build(selection, ratings)
+            conn.execute(
+                "INSERT INTO genre_profiles (username, kind, weights) VALUES (?, ?, ?)",
+                (username, kind, json.dumps(weights)),
+            )
+        return weights
+
+    def migrate_from_json(self, users_path=None, selections_path=None, ratings_path=None):
+        # One-shot import of the legacy JSON files; each file is imported at most once
+        imported = []
+        for kind, path in (("users", users_path), ("selections", selections_path), ("ratings", ratings_path)):
+            if path is None:
+                continue
+            name = kind + ":" + os.path.basename(path)
+            with self.pool.transaction() as conn:
+                if conn.execute("SELECT 1 FROM migrations WHERE name = ?", (name,)).fetchone():
+                    continue
+                data = None
+                if os.path.exists(path):
+                    with open(path, "r") as f:
+                        data = json.load(f)
+                if data:
+                    getattr(self, "_import_" + kind)(conn, data)
+                conn.execute("INSERT INTO migrations (name) VALUES (?)", (name,))
+            imported.append(name)
+        return imported
+
+    def _import_users(self, conn, users):
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)",
+            list(users.items()),
+        )
+
+    def _import_selections(self, conn, selections):
+        conn.executemany(
+            "INSERT OR IGNORE INTO selections (username, appids) VALUES (?, ?)",
+            [(username, json.dumps(appids)) for username, appids in selections.items()],
+        )
+
+    def _import_ratings(self, conn, ratings):
+        conn.executemany(
+            "INSERT INTO ratings (username, appid, rating) VALUES (?, ?, ?) "
+            "ON CONFLICT (username, appid) DO UPDATE SET rating = excluded.rating",
+            [(r['username'], str(r['appid']), r['rating']) for r in ratings],
+        )
+
+
+class _PendingWrite:
+    __slots__ = ('record', 'result', 'error', 'done')
+
+    def __init__(self, record):
+        self.record = record
+        self.result = None
+        self.error = None
+        self.done = False
+
+
+class LogRepository(Repository):
+    """Repository held in memory and persisted as a snapshot plus an append-only log.
+
+    Every write is one JSON line appended to log.<generation>.jsonl. Writes
+    from concurrent threads are grouped: whichever thread gets to the log
+    first appends (and fsyncs) the lines of every write queued so far, so
+    the cost per write falls as concurrency rises. Reads are served from the
+    in-memory state after applying any lines other processes appended.
+
+    snapshot.jsonl holds the full state as of the start of its generation's
+    log. compact(), run periodically by a background thread once the log
+    grows past `compact_bytes`, starts the next log, writes the new snapshot
+    to a temporary file and renames it into place. A crash at any point
+    therefore leaves either the old snapshot with its logs or the new one;
+    a half-written last line is dropped on the next write. Processes sharing
+    the directory serialise appends and compactions with an exclusive file
+    lock (fcntl; without it, only one process may use the directory).
+    """
+
+    SNAPSHOT = 'snapshot.jsonl'
+
+    def __init__(self, directory, fsync=True, compact_bytes=4 << 20, compact_interval=30.0):
+        self.directory = directory
+        self.fsync = fsync
+        self.compact_bytes = compact_bytes
+        self.compact_interval = compact_interval
+        os.makedirs(directory, exist_ok=True)
+        self._io_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = []
+        self._state = MemoryRepository()
+        self._migrations = set()
+        self._generation = 0
+        self._offset = 0
+        self._pid = None
+        self._lock_file = None
+        self._log = None
+        self._append_fd = None
+        self._append_generation = None
+        self._closed = threading.Event()
+        with self._io_lock:
+            self._open()
+            with self._exclusive():
+                self._reload(create=True)
+        self._start_compactor()
+
+    def _open(self):
+        # File handles must not cross a fork: a child sharing the parent's
+        # lock file would share its lock
+        self._pid = os.getpid()
+        self._lock_file = open(os.path.join(self.directory, 'lock'), 'a')
+        self._append_fd = None
+        self._append_generation = None
+
+    def _start_compactor(self):
+        if self.compact_interval:
+            threading.Thread(target=self._compact_loop, name='log-compactor', daemon=True).start()
+
+    def _check_pid(self):
+        # Threads do not survive a fork either, so the child starts its own compactor
+        if self._pid != os.getpid():
+            self._open()
+            self._reload()
+            self._start_compactor()
+
+    @contextmanager
+    def _exclusive(self):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _log_path(self, generation):
+        return os.path.join(self.directory, 'log.%d.jsonl' % generation)
+
+    def _reload(self, create=False):
+        # Rebuilds the in-memory state from the snapshot and the logs after it.
+        # Another process may compact meanwhile, so a vanished log means retry.
+        while True:
+            state = MemoryRepository()
+            migrations = set()
+            generation = 0
+            try:
+                with open(os.path.join(self.directory, self.SNAPSHOT), 'rb') as f:
+                    generation = json.loads(f.readline())['generation']
+                    for line in f:
+                        self._apply(state, migrations, json.loads(line))
+            except FileNotFoundError:
+                pass
+            if create:
+                open(self._log_path(generation), 'ab').close()
+            try:
+                log = open(self._log_path(generation), 'rb')
+            except FileNotFoundError:
+                continue
+            if self._log is not None:
+                self._log.close()
+            self._state, self._migrations = state, migrations
+            self._log, self._generation, self._offset = log, generation, 0
+            self._catch_up(repair=create)
+            return
+
+    def _catch_up(self, repair=False):
+        # Applies the lines appended since the last call, following the log
+        # into later generations after a compaction. repair (only with the
+        # file lock held) cuts off a line left half-written by a crash.
+        while True:
+            size = os.fstat(self._log.fileno()).st_size
+            if size > self._offset:
+                self._log.seek(self._offset)
+                data = self._log.read(size - self._offset)
+                end = data.rfind(b'\n') + 1
+                for line in data[:end].splitlines():
+                    if line.strip():
+                        self._apply(self._state, self._migrations, json.loads(line))
+                self._offset += end
+                if repair and end < len(data):
+                    os.truncate(self._log_path(self._generation), self._offset)
+            if os.path.exists(self._log_path(self._generation + 1)):
+                self._log.close()
+                self._log = open(self._log_path(self._generation + 1), 'rb')
+                self._generation += 1
+                self._offset = 0
+            elif not os.path.exists(self._log_path(self._generation)):
+                # Compacted more than once since this process last looked
+                self._reload()
+                return
+            else:
+                return
+
+    @staticmethod
+    def _apply(state, migrations, record):
+        # Applies one log record to `state`; returns (result, whether to log it)
+        op = record['op']
+        if op == 'rating':
+            return state.upsert_rating(record['username'], record['appid'], record['rating']), True
+        if op == 'selection':
+            return state.save_selection(record['username'], record['appids']), True
+        if op == 'rating_profile':
+            return state.upsert_rating_with_profile(
+                record['username'], record['appid'], record['rating'], record['kind'], record['previous'],
+                record['deltas'],
+            ), True
+        if op == 'user':
+            # Written by snapshots and the JSON import, which only add users that do not exist
+            with state._lock:
+                state._users[record['username']] = record['password']
+            return None, True
+        if op == 'user_create':
+            created = state.create_user(record['username'], record['password'])
+            return created, created
+        if op == 'profile':
+            return state.save_genre_profile(record['username'], record['kind'], record['weights']), True
+        if op == 'profile_add':
+            # Only found in logs written before ratings and their deltas became one record
+            weights = state.genre_profile(record['username'], record['kind'])
+            if weights is None:
+                return False, False
+            state.save_genre_profile(record['username'], record['kind'], merge_genre_weights(weights, record['deltas']))
+            return True, True
+        if op == 'profile_delete':
+            return state.delete_genre_profile(record['username'], record['kind']), True
+        if op == 'profile_init':
+            # Kept only if the user's data is still what the profile was built from
+            username = record['username']
+            current = _profile_inputs(state.selection_for(username), state.ratings_for(username))
+            stored = state.genre_profile(username, record['kind']) is None and current == record['inputs']
+            if stored:
+                state.save_genre_profile(username, record['kind'], record['weights'])
+            return stored, stored
+        if op == 'migrated':
+            migrations.add(record['name'])
+            return None, True
+        raise ValueError("Unknown log record %r" % op)
+
+    def _write(self, record):
+        return self._write_all([record])[0]
+
+    def _write_all(self, records):
+        # Queues the records and returns the results of applying them. The
+        # thread that takes the I/O lock appends every queued record at once;
+        # the others find their records already written when they get it.
+        batch = [_PendingWrite(record) for record in records]
+        with self._pending_lock:
+            self._pending.extend(batch)
+        with self._io_lock:
+            if not batch[-1].done:
+                with self._pending_lock:
+                    pending, self._pending = self._pending, []
+                self._flush(pending)
+        for pending in batch:
+            if pending.error is not None:
+                raise pending.error
+        return [pending.result for pending in batch]
+
+    def _flush(self, batch):
+        self._check_pid()
+        try:
+            with self._exclusive():
+                self._catch_up(repair=True)
+                lines = []
+                for pending in batch:
+                    pending.result, logged = self._apply(self._state, self._migrations, pending.record)
+                    if logged:
+                        lines.append(json.dumps(pending.record, separators=(',', ':')))
+                if lines:
+                    self._append(('\n'.join(lines) + '\n').encode('utf-8'))
+        except Exception as error:
+            # Memory may now be ahead of the log; start again from the files
+            for pending in batch:
+                pending.error = error
+            self._reload()
+        finally:
+            for pending in batch:
+                pending.done = True
+
+    def _append(self, data):
+        if self._append_generation != self._generation:
+            if self._append_fd is not None:
+                os.close(self._append_fd)
+            self._append_fd = os.open(self._log_path(self._generation), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            self._append_generation = self._generation
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._append_fd, view):]
+        if self.fsync:
+            os.fsync(self._append_fd)
+        # Our own lines were applied before writing them
+        self._offset += len(data)
+
+    def _read(self):
+        # Brings the in-memory state up to date with the log before a read
+        with self._io_lock:
+            self._check_pid()
+            self._catch_up()
+        return self._state
+
+    def compact(self):
+        # Folds the log into a new snapshot and starts an empty log
+        with self._io_lock:
+            self._check_pid()
+            with self._exclusive():
+                self._catch_up(repair=True)
+                generation = self._generation + 1
+                # Writers move to the new log from here on; if we crash before
+                # the rename below, the old snapshot plus both logs still replay
+                open(self._log_path(generation), 'ab').close()
+
+                path = os.path.join(self.directory, self.SNAPSHOT)
+                tmp_path = '%s.tmp-%d' % (path, os.getpid())
+                with open(tmp_path, 'w') as f:
+                    f.write(json.dumps({'generation': generation}) + '\n')
+                    for record in self._snapshot_records():
+                        f.write(json.dumps(record, separators=(',', ':')) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+                _fsync_directory(self.directory)
+
+                self._catch_up()
+                for entry in os.listdir(self.directory):
+                    if entry.startswith('log.') and entry.endswith('.jsonl'):
+                        try:
+                            if int(entry.split('.')[1]) < generation:
+                                os.remove(os.path.join(self.directory, entry))
+                        except (ValueError, OSError):
+                            pass
+
+    def _snapshot_records(self):
+        state = self._state
+        for username, password in state.load_users().items():
+            yield {'op': 'user', 'username': username, 'password': password}
+        for username, appids in state.all_selections().items():
+            yield {'op': 'selection', 'username': username, 'appids': appids}
+        for r in state.all_ratings():
+            yield {'op': 'rating', 'username': r['username'], 'appid': r['appid'], 'rating': r['rating']}
+        with state._lock:
+            profiles = list(state._profiles.items())
+        for (username, kind), weights in profiles:
+            yield {'op': 'profile', 'username': username, 'kind': kind, 'weights': weights}
+        for name in sorted(self._migrations):
+            yield {'op': 'migrated', 'name': name}
+
+    def _compact_loop(self):
+        while not self._closed.wait(self.compact_interval):
+            try:
+                if os.path.getsize(self._log_path(self._generation)) >= self.compact_bytes:
+                    self.compact()
+            except OSError:
+                pass
+
+    def close(self):
+        self._closed.set()
+        with self._io_lock:
+            if self._append_fd is not None:
+                os.close(self._append_fd)
+                self._append_fd = None
+            self._log.close()
+            self._lock_file.close()
+
+    def load_users(self):
+        return self._read().load_users()
+
+    def create_user(self, username, password):
+        return self._write({'op': 'user_create', 'username': username, 'password': password})
+
+    def selection_for(self, username):
+        return self._read().selection_for(username)
+
+    def all_selections(self):
+        return self._read().all_selections()
+
+    def save_selection(self, username, appids):
+        self._write({'op': 'selection', 'username': username, 'appids': list(appids)})
+
+    def ratings_for(self, username):
+        return self._read().ratings_for(username)
+
+    def all_ratings(self):
+        return self._read().all_ratings()
+
+    def upsert_rating(self, username, appid, rating):
+        return self._write({'op': 'rating', 'username': username, 'appid': appid, 'rating': rating})
+
+    def upsert_rating_with_profile(self, username, appid, rating, kind, previous, deltas):
+        return self._write({'op': 'rating_profile', 'username': username, 'appid': appid, 'rating': rating,
+                            'kind': kind, 'previous': previous, 'deltas': dict(deltas)})
+
+    def genre_profile(self, username, kind):
+        return self._read().genre_profile(username, kind)
+
+    def save_genre_profile(self, username, kind, weights):
+        self._write({'op': 'profile', 'username': username, 'kind': kind, 'weights': dict(weights)})
+
+    def delete_genre_profile(self, username, kind):
+        self._write({'op': 'profile_delete', 'username': username, 'kind': kind})
+
+    def ensure_genre_profile(self, username, kind, build):
+        state = self._read()
+        weights = state.genre_profile(username, kind)
+        if weights is not None:
+            return weights
+        selection, ratings = state.selection_for(username), state.ratings_for(username)
+        weights = build(selection, ratings)
+        record = {'op': 'profile_init', 'username': username, 'kind': kind, 'weights': dict(weights),
+                  'inputs': _profile_inputs(selection, ratings)}
+        if not self._write(record):
+            # Another write got in first; the next read builds from the newer data
+            weights = self._read().genre_profile(username, kind) or weights
+        return weights
+
+    def migrate_from_json(self, users_path=None, selections_path=None, ratings_path=None):
+        # Same one-shot import of the legacy JSON files as SqliteRepository's;
+        # existing users and selections are kept
+        imported = []
+        for kind, path in (("users", users_path), ("selections", selections_path), ("ratings", ratings_path)):
+            if path is None:
+                continue
+            name = kind + ":" + os.path.basename(path)
+            state = self._read()
+            if name in self._migrations:
+                continue
+            data = None
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    data = json.load(f)
+            records = []
+            if data and kind == "users":
+                users = state.load_users()
+                records = [{'op': 'user', 'username': username, 'password': password}
+                           for username, password in data.items() if username not in users]
+            elif data and kind == "selections":
+                selections = state.all_selections()
+                records = [{'op': 'selection', 'username': username, 'appids': list(appids)}
+                           for username, appids in data.items() if username not in selections]
+            elif data:
+                records = [{'op': 'rating', 'username': r['username'], 'appid': str(r['appid']), 'rating': r['rating']}
+                           for r in data]
+            self._write_all(records + [{'op': 'migrated', 'name': name}])
+            imported.append(name)
+        return imported
+
+
+def _fsync_directory(directory):
+    # Makes a rename in `directory` durable; not possible (nor needed) on Windows
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class CachedRepository(Repository):
+    """Write-through cache in front of another repository.
+
+    Per-user selections and ratings are served from memory after the first
+    read, and every write goes to the backend before the cache is updated.
+    Entries older than `ttl` seconds are re-read so that writes made by other
+    worker processes show up; ttl=None keeps them until this process writes.
+    Users are always read from the backend.
+    """
+
+    def __init__(self, backend, ttl=None):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._selections = {}
+        self._ratings = {}
+        self._profiles = {}
+
+    def _fresh(self, entry):
+        return entry is not None and (self.ttl is None or time.monotonic() - entry[0] < self.ttl)
+
+    def _cached(self, cache, key, load):
+        entry = cache.get(key)
+        if not self._fresh(entry):
+            entry = (time.monotonic(), load())
+            with self._lock:
+                cache[key] = entry
+        return entry[1]
+
+    # Users are not cached: a login must see an account registered on
+    # another worker, and registration must not trust a stale user list
+    def load_users(self):
+        return self.backend.load_users()
+
+    def create_user(self, username, password):
+        return self.backend.create_user(username, password)
+
+    def selection_for(self, username):
+        return list(self._cached(self._selections, username, lambda: self.backend.selection_for(username)))
+
+    def all_selections(self):
+        return self.backend.all_selections()
+
+    def save_selection(self, username, appids):
+        self.backend.save_selection(username, appids)
+        with self._lock:
+            self._selections[username] = (time.monotonic(), list(appids))
+
+    def ratings_for(self, username):
+        ratings = self._cached(self._ratings, username, lambda: self.backend.ratings_for(username))
+        return [dict(r) for r in ratings]
+
+    def all_ratings(self):
+        return self.backend.all_ratings()
+
+    def upsert_rating(self, username, appid, rating):
+        previous = self.backend.upsert_rating(username, appid, rating)
+        self._cache_rating(username, appid, rating)
+        return previous
+
+    def upsert_rating_with_profile(self, username, appid, rating, kind, previous, deltas):
+        replaced = self.backend.upsert_rating_with_profile(username, appid, rating, kind, previous, deltas)
+        self._cache_rating(username, appid, rating)
+        with self._lock:
+            self._profiles.pop((username, kind), None)
+        return replaced
+
+    def _cache_rating(self, username, appid, rating):
+        with self._lock:
+            entry = self._ratings.get(username)
+            if entry is None:
+                return
+            ratings = [dict(r) for r in entry[1]]
+            for r in ratings:
+                if r['appid'] == appid:
+                    r['rating'] = rating
+                    break
+            else:
+                ratings.append({"username": username, "appid": appid, "rating": rating})
+            self._ratings[username] = (entry[0], ratings)
+
+    def genre_profile(self, username, kind):
+        weights = self._cached(self._profiles, (username, kind), lambda: self.backend.genre_profile(username, kind))
+        return dict(weights) if weights is not None else None
+
+    def save_genre_profile(self, username, kind, weights):
+        self.backend.save_genre_profile(username, kind, weights)
+        with self._lock:
+            self._profiles[(username, kind)] = (time.monotonic(), dict(weights))
+
+    def delete_genre_profile(self, username, kind):
+        self.backend.delete_genre_profile(username, kind)
+        with self._lock:
+            self._profiles.pop((username, kind), None)
+
+    def ensure_genre_profile(self, username, kind, build):
+        # Built by the backend from its own data, never from this cache's possibly stale copies
+        entry = self._profiles.get((username, kind))
+        if self._fresh(entry) and entry[1] is not None:
+            return dict(entry[1])
+        weights = self.backend.ensure_genre_profile(username, kind, build)
+        with self._lock:
+            self._profiles[(username, kind)] = (time.monotonic(), dict(weights))
+        return dict(weights)
@@ -0,0 +1,157 @@
+"""Synthetic catalogs and users in the shape of items.csv and the user store.
+
+Used by benchmark.py; everything is generated from a seed, so two runs with
+the same arguments see the same data.
+"""
+import numpy as np
+import pandas as pd
+
+from storage import MemoryRepository
+
+
+# Same header as items.csv. Like the real file, every row is shifted by one
+# column: the game name sits under 'AppID', the release date under 'Name' and
+# the owner range under 'Release date'.
+COLUMNS = [
+    'AppID', 'Name', 'Release date', 'Estimated owners', 'Price', 'Metacritic score', 'User score',
+    'Positive', 'Negative', 'Score rank', 'Recommendations', 'Average playtime forever',
+    'Median playtime forever', 'Developers', 'Publishers', 'Categories', 'Genres', 'Tags',
+]
+
+GENRES = [
+    'Indie', 'Action', 'Casual', 'Adventure', 'Strategy', 'Simulation', 'RPG', 'Early Access',
+    'Free to Play', 'Sports', 'Racing', 'Massively Multiplayer', 'Education', 'Utilities',
+    'Design & Illustration', 'Animation & Modeling', 'Violent', 'Gore', 'Audio Production', 'Nudity',
+]
+
+CATEGORIES = [
+    'Single-player', 'Multi-player', 'PvP', 'Online PvP', 'Co-op', 'Online Co-op', 'Steam Achievements',
+    'Steam Trading Cards', 'Steam Cloud', 'Full controller support', 'Partial Controller Support',
+    'Steam Workshop', 'Remote Play Together', 'Steam Leaderboards', 'In-App Purchases', 'Family Sharing',
+]
+
+TAGS = [
+    '2D', '3D', 'Atmospheric', 'Story Rich', 'Puzzle', 'Platformer', 'Pixel Graphics', 'Funny',
+    'Difficult', 'Horror', 'Survival', 'Open World', 'Sandbox', 'Roguelike', 'Roguelite', 'Shooter',
+    'FPS', 'Third Person', 'First-Person', 'Fantasy', 'Sci-fi', 'Space', 'Cute', 'Colorful',
+    'Relaxing', 'Multiplayer', 'Co-op', 'Local Multiplayer', 'Competitive', 'Team-Based', 'Tactical',
+    'Turn-Based', 'Card Game', 'Deckbuilding', 'Building', 'Crafting', 'Management', 'Economy',
+    'Stealth', 'Hack and Slash', 'Souls-like', 'Metroidvania', 'Visual Novel', 'Anime', 'Retro',
+    'Arcade', 'Physics', 'Music', 'Rhythm', 'Family Friendly', 'Comedy', 'Dark', 'Mystery',
+    'Exploration', 'Point & Click', 'Walking Simulator', 'Choices Matter', 'Multiple Endings',
+    'Zombies', 'Post-apocalyptic', 'Military', 'War', 'Historical', 'Medieval', 'Cyberpunk',
+    'Driving', 'Flight', 'Fishing', 'Farming Sim', 'Life Sim', 'Education', 'Word Game', 'Trivia',
+]
+
+NAME_WORDS = [
+    'Shadow', 'Legend', 'Star', 'Dungeon', 'Empire', 'Quest', 'Dragon', 'Craft', 'Tales', 'Night',
+    'Iron', 'Galaxy', 'Kingdom', 'Rogue', 'Pixel', 'Storm', 'Hollow', 'Crystal', 'Frontier', 'Echo',
+    'Neon', 'Forest', 'Ocean', 'Sky', 'Battle', 'Arena', 'Tower', 'Island', 'City', 'Farm',
+    'Racer', 'Hunter', 'Knight', 'Wizard', 'Robot', 'Zombie', 'Space', 'Cave', 'Castle', 'River',
+]
+
+STUDIO_WORDS = ['Studio', 'Games', 'Interactive', 'Entertainment', 'Works', 'Labs', 'Soft', 'Digital']
+
+OWNER_RANGES = [
+    (0, 20000), (20000, 50000), (50000, 100000), (100000, 200000), (200000, 500000),
+    (500000, 1000000), (1000000, 2000000), (2000000, 5000000), (5000000, 10000000),
+]
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def _zipf_weights(n, exponent=1.1):
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def _pick_many(rng, vocabulary, weights, low, high, n_rows):
+    # One comma-joined, duplicate-free sample of low..high values per row
+    sizes = rng.integers(low, high + 1, size=n_rows)
+    return [
+        ','.join(vocabulary[i] for i in rng.choice(len(vocabulary), size=size, replace=False, p=weights))
+        for size in sizes
+    ]
+
+
+def synthetic_catalog(n_rows, seed=0):
+    """A DataFrame in the layout of items.csv, with skewed genre and owner distributions."""
+    rng = np.random.default_rng(seed)
+
+    first = rng.integers(0, len(NAME_WORDS), size=n_rows)
+    second = rng.integers(0, len(NAME_WORDS), size=n_rows)
+    names = ['%s %s %d' % (NAME_WORDS[a], NAME_WORDS[b], i) for i, (a, b) in enumerate(zip(first, second))]
+
+    n_studios = max(10, n_rows // 20)
+    studios = ['%s %s' % (NAME_WORDS[i % len(NAME_WORDS)], STUDIO_WORDS[i % len(STUDIO_WORDS)]) + ' %d' % i
+               for i in range(n_studios)]
+    developer = rng.choice(n_studios, size=n_rows, p=_zipf_weights(n_studios, 0.8))
+    publisher = np.where(rng.random(n_rows) < 0.6, developer, rng.choice(n_studios, size=n_rows))
+
+    # Heavy-tailed popularity: most games are small, a few are huge
+    popularity = rng.lognormal(mean=6.0, sigma=1.6, size=n_rows)
+    owners_bucket = np.clip((np.log10(popularity + 1) * 2).astype(int), 0, len(OWNER_RANGES) - 1)
+    positive_share = rng.beta(8, 2, size=n_rows)
+    reviews = (popularity * rng.uniform(0.5, 3.0, size=n_rows)).astype('int64')
+    positive = (reviews * positive_share).astype('int64')
+
+    years = rng.integers(2006, 2025, size=n_rows)
+    months = rng.integers(0, 12, size=n_rows)
+    days = rng.integers(1, 29, size=n_rows)
+
+    columns = {
+        'AppID': names,
+        'Name': ['%s %d, %d' % (MONTHS[m], d, y) for m, d, y in zip(months, days, years)],
+        'Release date': ['%d - %d' % OWNER_RANGES[bucket] for bucket in owners_bucket],
+        'Estimated owners': popularity.astype('int64'),
+        'Price': np.round(rng.choice([0.0, 4.99, 9.99, 14.99, 19.99, 29.99, 59.99], size=n_rows), 2),
+        'Metacritic score': np.where(rng.random(n_rows) < 0.1, rng.integers(40, 98, size=n_rows), 0),
+        'User score': np.zeros(n_rows, dtype='int64'),
+        'Positive': positive,
+        'Negative': reviews - positive,
+        'Score rank': np.full(n_rows, np.nan),
+        'Recommendations': (reviews * rng.uniform(0.5, 1.5, size=n_rows)).astype('int64'),
+        'Average playtime forever': rng.integers(0, 3000, size=n_rows),
+        'Median playtime forever': rng.integers(0, 1500, size=n_rows),
+        'Developers': [studios[i] for i in developer],
+        'Publishers': [studios[i] for i in publisher],
+        'Categories': _pick_many(rng, CATEGORIES, _zipf_weights(len(CATEGORIES), 0.7), 1, 8, n_rows),
+        'Genres': _pick_many(rng, GENRES, _zipf_weights(len(GENRES)), 1, 4, n_rows),
+        'Tags': _pick_many(rng, TAGS, _zipf_weights(len(TAGS), 0.6), 5, 15, n_rows),
+    }
+    return pd.DataFrame(columns, columns=COLUMNS)
+
+
+def write_catalog(path, n_rows, seed=0):
+    synthetic_catalog(n_rows, seed).to_csv(path, index=False)
+    return path
+
+
+def synthetic_users(df, n_users, seed=0, max_ratings=20):
+    """(users, selections, ratings) for n_users, biased toward popular games.
+
+    Every user has 5 selected games and 0..max_ratings ratings, in the shapes
+    the repositories use.
+    """
+    rng = np.random.default_rng(seed)
+    appids = df['AppID'].astype(str).to_numpy()
+    weights = df['Estimated owners'].to_numpy().astype('float64') + 1.0
+    weights /= weights.sum()
+
+    users = {}
+    selections = {}
+    ratings = []
+    for i in range(n_users):
+        username = 'user%d' % i
+        users[username] = 'password%d' % i
+        picks = rng.choice(len(appids), size=min(5 + max_ratings, len(appids)), replace=False, p=weights)
+        selections[username] = [str(appids[row]) for row in picks[:5]]
+        n_ratings = rng.integers(0, max_ratings + 1)
+        for row in picks[5:5 + n_ratings]:
+            ratings.append({'username': username, 'appid': str(appids[row]), 'rating': int(rng.integers(1, 6))})
+    return users, selections, ratings
+
+
+def synthetic_repository(df, n_users, seed=0, max_ratings=20):
+    users, selections, ratings = synthetic_users(df, n_users, seed, max_ratings)
+    return MemoryRepository(users, selections, ratings)
@@ -0,0 +1,110 @@
+"""Tests of the web app over a small synthetic catalog and an in-memory store.
+
+Run from the repository root with
+
+    python -m pytest Website
+"""
+from urllib.parse import quote
+
+import pytest
+
+import app as webapp
+from Backend import set_repository
+from cache import CACHES
+from catalog import Catalog, set_catalog
+from genre_index import SORT_COLUMNS
+from synthetic import synthetic_repository, write_catalog
+
+
+@pytest.fixture(scope='module')
+def catalog(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('catalog')
+    path = write_catalog(str(workdir / 'items.csv'), 500)
+    catalog = Catalog(path, str(workdir / 'genre-model.npz'), str(workdir / 'cache')).refresh()
+    set_catalog(catalog)
+    yield catalog
+    set_catalog(None)
+
+
+@pytest.fixture
+def repository(catalog):
+    repository = synthetic_repository(catalog.df, 20)
+    set_repository(repository)
+    for cache in CACHES.values():
+        cache.clear()
+    yield repository
+    set_repository(None)
+
+
+@pytest.fixture
+def client(repository):
+    return webapp.app.test_client()
+
+
+def log_in(client, username):
+    with client.session_transaction() as session:
+        session['username'] = username
+
+
+@pytest.mark.parametrize('username', [None, 'user1'])
+def test_unknown_filter_falls_back_to_owners(client, username):
+    if username:
+        log_in(client, username)
+    expected = client.get('/?filter=owners')
+    response = client.get('/?filter=bogus')
+    assert response.status_code == 200
+    assert response.data == expected.data
+
+
+def test_user_page_follows_writes_from_other_workers(client, repository, catalog):
+    # A write that bypasses this process, as one handled by another worker would
+    log_in(client, 'user1')
+    before = client.get('/')
+    # Rated games leave the blocks, so rating the games shown changes the page
+    shown = [appid for appid in catalog.df['AppID'].astype(str) if appid.encode('utf-8') in before.data]
+    assert shown
+    for appid in shown[:5]:
+        repository.upsert_rating('user1', appid, 5)
+
+    after = client.get('/')
+    assert after.get_etag() != before.get_etag()
+    for cache in CACHES.values():
+        cache.clear()
+    fresh = client.get('/')
+    assert fresh.get_etag() == after.get_etag()
+    assert fresh.data == after.data
+
+
+def test_item_page_only_maps_saved_similar_items(client, catalog):
+    # Requests never fit the similar-games index; the page gains it once built offline
+    url = '/item/' + quote(str(catalog.df['AppID'].iloc[0]), safe='')
+    assert catalog.similar_items() is None
+    before = client.get(url)
+    assert before.status_code == 200
+    assert b'Similar Games' not in before.data
+
+    catalog.build_similar_items()
+    after = client.get(url)
+    assert after.get_etag() != before.get_etag()
+    assert b'Similar Games' in after.data
+
+
+@pytest.mark.parametrize('limit', [-3, 0, 1, 5, 1000])
+def test_autocomplete_limit_is_clamped(client, catalog, limit):
+    query = str(catalog.df['AppID'].iloc[0])[:2]
+    names = client.get('/api/autocomplete?q=%s&limit=%d' % (query, limit)).get_json()
+    assert 1 <= len(names) <= min(max(limit, 1), webapp.SEARCH_LIMIT)
+    index = catalog.search_index()
+    assert len(index.search(query, limit=limit)) == min(max(limit, 0), len(index.search(query)))
+
+
+@pytest.mark.parametrize('filter_option', list(SORT_COLUMNS))
+def test_every_filter_ranks_by_its_column(client, catalog, filter_option):
+    response = client.get('/?filter=' + filter_option)
+    assert response.status_code == 200
+    assert ('<option value="%s" selected>' % filter_option).encode('utf-8') in response.data
+    # The first game of the overall list has the best score of the column
+    column = catalog.df[SORT_COLUMNS[filter_option]]
+    best = str(catalog.df['AppID'].iloc[int(column.to_numpy().argmax())])
+    top = response.data.split(b'<h2>Top 20 Games', 1)[1]
+    assert top.index(best.encode('utf-8')) < top.index(b'</a>')
@@ -0,0 +1,96 @@
+"""Tests of the user data repositories and the genre profiles kept in them.
+
+Run from the repository root with
+
+    python -m pytest Website
+"""
+import threading
+
+import pytest
+
+from Backend import (RATINGS_PROFILE, add_or_update_user_rating, load_user_genre_weights, profile_kind,
+                     rating_genre_weights, set_repository)
+from storage import CachedRepository, LogRepository, MemoryRepository, SqliteRepository
+from synthetic import synthetic_catalog
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'log', 'cached'])
+def repository(request, tmp_path):
+    if request.param == 'memory':
+        repository = MemoryRepository()
+    elif request.param == 'sqlite':
+        repository = SqliteRepository(str(tmp_path / 'user_data.db'))
+    elif request.param == 'log':
+        repository = LogRepository(str(tmp_path / 'log'), fsync=False, compact_interval=None)
+    else:
+        repository = CachedRepository(SqliteRepository(str(tmp_path / 'user_data.db')), ttl=30)
+    set_repository(repository)
+    yield repository
+    if request.param == 'log':
+        repository.close()
+    set_repository(None)
+
+
+def assert_same_weights(weights, expected):
+    assert set(weights) == set(expected)
+    for genre, weight in expected.items():
+        assert weights[genre] == pytest.approx(weight)
+
+
+def test_profile_matches_rebuild_under_concurrent_rebuilds(repository):
+    # A profile rebuilt while a rating is written must not count the rating twice
+    df = synthetic_catalog(200, 0)
+    appids = df['AppID'].astype(str).tolist()
+    fingerprint = 'catalog-1'
+    kind = profile_kind(RATINGS_PROFILE, fingerprint)
+    genres = {appid: [g.strip() for g in text.split(',')] for appid, text in zip(appids, df['Genres'])}
+
+    for i in range(60):
+        repository.delete_genre_profile('alice', kind)
+        appid = appids[i % 20]
+        start = threading.Barrier(2)
+
+        def rate():
+            start.wait()
+            add_or_update_user_rating('alice', appid, 1 + i % 5, fingerprint, genres[appid])
+
+        def rebuild():
+            start.wait()
+            load_user_genre_weights('alice', df, fingerprint)
+
+        threads = [threading.Thread(target=rate), threading.Thread(target=rebuild)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        weights, _ = load_user_genre_weights('alice', df, fingerprint)
+        assert_same_weights(weights, rating_genre_weights(df, repository.ratings_for('alice')))
+
+
+def test_rating_with_another_previous_drops_profile(repository):
+    kind = profile_kind(RATINGS_PROFILE, 'catalog-1')
+    repository.upsert_rating('alice', 'Game', 2)
+    repository.save_genre_profile('alice', kind, {'Action': 0.3})
+    # The caller computed its deltas from a rating that is no longer stored
+    assert repository.upsert_rating_with_profile('alice', 'Game', 5, kind, None, {'Action': 1.0}) == 2
+    assert repository.genre_profile('alice', kind) is None
+
+    repository.save_genre_profile('alice', kind, {'Action': 1.0})
+    assert repository.upsert_rating_with_profile('alice', 'Game', 4, kind, 5, {'Action': -0.2}) == 5
+    assert_same_weights(repository.genre_profile('alice', kind), {'Action': 0.8})
+
+
+def test_profiles_are_per_catalog_version(repository):
+    df = synthetic_catalog(50, 0)
+    appid = str(df['AppID'].iloc[0])
+    load_user_genre_weights('alice', df, 'catalog-1')
+    # The game's genres in catalog-1, which `df` no longer has
+    add_or_update_user_rating('alice', appid, 5, 'catalog-1', ['Removed Genre'])
+    weights, _ = load_user_genre_weights('alice', df, 'catalog-1')
+    assert_same_weights(weights, {'Removed Genre': 1.0})
+
+    # The next catalog version builds its own profile from its own genres
+    weights, _ = load_user_genre_weights('alice', df, 'catalog-2')
+    assert 'Removed Genre' not in weights
+    assert_same_weights(weights, rating_genre_weights(df, repository.ratings_for('alice')))
@@ -0,0 +1,132 @@
+"""Equivalence tests for the partial-sort ranking helpers.
+
+top_k and intersect_ranked must return exactly what the full sorts they
+replaced returned, ties included. Run from the repository root with
+
+    python -m pytest Website
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from Backend import get_top_genre_blocks
+from genre_index import SORT_COLUMNS, GenreIndex
+from scoring import compute_scores
+from synthetic import synthetic_catalog
+from topk import intersect_ranked, top_k
+
+
+def reference_top_k(values, k, exclude=None):
+    order = np.argsort(-np.asarray(values), kind='stable')
+    if exclude is not None:
+        order = order[~exclude[order]]
+    return order[:k]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_top_k_matches_stable_argsort(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(0, 300))
+    # Few distinct values, so most of the cut falls among ties
+    ints = rng.integers(0, 10, size=n)
+    floats = rng.integers(0, 10, size=n) / 4.0
+    floats[rng.random(n) < 0.1] = np.nan
+    exclude = rng.random(n) < 0.3
+    for values in (ints, floats):
+        for k in (0, 1, 5, 20, n, n + 10):
+            assert np.array_equal(top_k(values, k), reference_top_k(values, k))
+            assert np.array_equal(top_k(values, k, exclude), reference_top_k(values, k, exclude))
+
+
+def test_top_k_all_excluded():
+    values = np.arange(10)
+    assert len(top_k(values, 5, np.ones(10, dtype=bool))) == 0
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_intersect_ranked_matches_isin(seed):
+    rng = np.random.default_rng(seed)
+    n_rows = 500
+    # One global ranking of the rows, as GenreIndex keeps per sort key
+    ranks = np.empty(n_rows, dtype='int64')
+    ranks[rng.permutation(n_rows)] = np.arange(n_rows)
+    exclude = rng.random(n_rows) < 0.2
+
+    for n_lists in (1, 2, 3):
+        lists = []
+        for _ in range(n_lists):
+            rows = np.flatnonzero(rng.random(n_rows) < rng.uniform(0.05, 0.8))
+            lists.append(rows[np.argsort(ranks[rows], kind='stable')])
+        rank_lists = [ranks[rows] for rows in lists]
+
+        common = lists[0]
+        for rows in lists[1:]:
+            common = common[np.isin(common, rows)]
+        for n in (1, 5, 20, 1000):
+            assert np.array_equal(intersect_ranked(lists, rank_lists, n), common[:n])
+            assert np.array_equal(intersect_ranked(lists, rank_lists, n, exclude), common[~exclude[common]][:n])
+
+
+def sort_values_blocks(df, top_n_genres=10, top_n_games=20, sort_by='owners'):
+    # The explode / groupby / sort_values path get_top_genre_blocks replaced,
+    # with row positions instead of records and stable sorts for the ties
+    genre_df = compute_scores(df.reset_index(drop=True).copy(), ['WilsonScore', 'BayesianRating'])
+    genre_df['Row'] = np.arange(len(genre_df))
+    genre_df['Genres'] = genre_df['Genres'].str.split(',')
+    genre_df = genre_df.explode('Genres')
+    genre_df['Genres'] = genre_df['Genres'].str.strip()
+
+    top_genres = (
+        genre_df.groupby('Genres')['Estimated owners']
+        .sum()
+        .sort_values(ascending=False, kind='stable')
+        .head(top_n_genres)
+        .index.tolist()
+    )
+
+    genre_blocks = {}
+    for genre in top_genres:
+        filtered = genre_df[genre_df['Genres'] == genre].copy()
+        if sort_by == 'rating':
+            filtered['RatingPercent'] = filtered.apply(lambda row: (
+                round(100 * row['Positive'] / (row['Positive'] + row['Negative']))
+                if row['Positive'] + row['Negative'] > 0 else 0
+            ), axis=1)
+            top_games = filtered.sort_values(by='RatingPercent', ascending=False, kind='stable').head(top_n_games)
+        elif sort_by == 'owners':
+            top_games = filtered.sort_values(by='Estimated owners', ascending=False, kind='stable').head(top_n_games)
+        else:
+            # Scores added by scoring.compute_scores before the explode
+            column = SORT_COLUMNS[sort_by]
+            top_games = filtered.sort_values(by=column, ascending=False, kind='stable').head(top_n_games)
+        genre_blocks[genre] = top_games['Row'].tolist()
+    return genre_blocks
+
+
+@pytest.mark.parametrize('sort_by', list(SORT_COLUMNS))
+@pytest.mark.parametrize('seed', range(3))
+def test_genre_blocks_match_sort_values(seed, sort_by):
+    df = synthetic_catalog(2000, seed)
+    # Coarse values, so many games tie within a genre
+    df['Estimated owners'] = df['Estimated owners'] // 500
+    expected = sort_values_blocks(df, sort_by=sort_by)
+    blocks = get_top_genre_blocks(df, sort_by=sort_by)
+    assert list(blocks) == list(expected)
+    for genre, rows in blocks.items():
+        assert np.asarray(rows).tolist() == expected[genre]
+
+
+@pytest.mark.parametrize('sort_by', list(SORT_COLUMNS))
+def test_multi_genre_rows_match_sort_values(sort_by):
+    df = synthetic_catalog(2000, 1)
+    df['Estimated owners'] = df['Estimated owners'] // 500
+    index = GenreIndex(df)
+    genre_lists = df['Genres'].str.split(',').map(lambda genres: {genre.strip() for genre in genres})
+    if sort_by == 'rating':
+        key = pd.Series([round(100 * p / (p + n)) if p + n > 0 else 0 for p, n in zip(df['Positive'], df['Negative'])])
+    else:
+        key = compute_scores(df.copy(), ['WilsonScore', 'BayesianRating'])[SORT_COLUMNS[sort_by]]
+    for genres in (['Action', 'Indie'], ['Adventure', 'Casual', 'Indie'], ['Strategy', 'Simulation']):
+        mask = genre_lists.map(lambda game: set(genres) <= game).to_numpy()
+        expected = key[mask].sort_values(ascending=False, kind='stable').index.tolist()[:20]
+        assert index.rows_with_all(genres, sort_by, 20).tolist() == expected
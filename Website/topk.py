@@ -0,0 +1,78 @@
+import numpy as np
+
+
+def top_k(values, k, exclude=None):
+    """Positions of the k largest values, best first, ties in position order.
+
+    Same result as np.argsort(-values, kind='stable')[:k], but only the k
+    selected entries are sorted: np.partition finds the k-th largest value in
+    linear time. `exclude` is an optional boolean mask of positions that must
+    not be returned; they are dropped before selecting, so up to k remain.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        # argsort puts NaN last; -inf keeps it there
+        values = np.where(np.isnan(values), -np.inf, values)
+
+    candidates = None
+    if exclude is not None:
+        candidates = np.flatnonzero(~np.asarray(exclude, dtype=bool))
+        values = values[candidates]
+
+    n = len(values)
+    k = max(0, min(int(k), n))
+    if k == 0:
+        return np.empty(0, dtype='int64')
+
+    if k < n:
+        threshold = np.partition(values, n - k)[n - k]
+        above = np.flatnonzero(values > threshold)
+        # Only the first few of the rows tied at the threshold make the cut
+        tied = np.flatnonzero(values == threshold)[:k - len(above)]
+        selected = np.concatenate([above, tied])
+    else:
+        selected = np.arange(n)
+
+    order = np.lexsort((selected, -values[selected]))
+    positions = selected[order]
+    return positions if candidates is None else candidates[positions]
+
+
+def intersect_ranked(lists, rank_lists, n, exclude=None):
+    """First n rows present in every list, in rank order.
+
+    Every list holds row positions sorted by rank, and rank_lists holds the
+    matching (ascending) ranks (see genre_index.GenreIndex). The shortest
+    list is walked in growing chunks and each chunk is checked against the
+    others with a binary search on their ranks, so the walk stops once n
+    common rows have been found instead of intersecting the full lists.
+    """
+    if not lists:
+        return np.empty(0, dtype='int64')
+    order = sorted(range(len(lists)), key=lambda i: len(lists[i]))
+    first, first_ranks = lists[order[0]], rank_lists[order[0]]
+    other_ranks = [rank_lists[i] for i in order[1:]]
+
+    found = []
+    n_found = 0
+    start = 0
+    chunk = max(4 * n, 64)
+    while start < len(first) and n_found < n:
+        rows = first[start:start + chunk]
+        rows_ranks = first_ranks[start:start + chunk]
+        if exclude is not None:
+            keep = ~exclude[rows]
+            rows, rows_ranks = rows[keep], rows_ranks[keep]
+        for sorted_ranks in other_ranks:
+            at = np.searchsorted(sorted_ranks, rows_ranks)
+            keep = at < len(sorted_ranks)
+            keep[keep] = sorted_ranks[at[keep]] == rows_ranks[keep]
+            rows, rows_ranks = rows[keep], rows_ranks[keep]
+        found.append(rows)
+        n_found += len(rows)
+        start += chunk
+        chunk *= 2
+
+    if not found:
+        return np.empty(0, dtype='int64')
+    return np.concatenate(found)[:n]